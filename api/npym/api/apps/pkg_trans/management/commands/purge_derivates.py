@@ -1,5 +1,6 @@
+from itertools import islice
+
 from django.core.management import BaseCommand
-from rich.pretty import pprint
 
 from npym.api.apps.pkg_trans.models import Distribution
 
@@ -10,7 +11,21 @@ class Command(BaseCommand):
     """
 
     def handle(self, *args, **options):
-        pprint(Distribution.objects.exclude(generated_for__isnull=True).delete())
-        pprint(
-            Distribution.objects.exclude(dependencies=False).update(dependencies=False)
+        ids = (
+            Distribution.objects.exclude(generated_for__isnull=True)
+            .values_list("pk", flat=True)
+            .iterator(chunk_size=1000)
         )
+        deleted = 0
+
+        # Deleting by batches so that Django doesn't load every single
+        # distribution in memory to figure out the cascades
+        while batch := list(islice(ids, 1000)):
+            count, _ = Distribution.objects.filter(pk__in=batch).delete()
+            deleted += count
+
+        reset = Distribution.objects.exclude(dependencies=False).update(
+            dependencies=False
+        )
+
+        self.stdout.write(f"Deleted {deleted} objects, reset {reset} distributions")
@@ -1,3 +1,5 @@
+from time import perf_counter
+
 from django.core.management import BaseCommand
 from rich.pretty import pprint
 
@@ -17,6 +19,11 @@ class Command(BaseCommand):
         #     distribution__js_name="sass-loader", js_version="13.2.0"
         # )
         r = Resolver(v)
+
+        start = perf_counter()
         r.build_dep_tree()
+        self.stdout.write(f"Built dependency tree in {perf_counter() - start:.2f}s")
 
-        pprint(r.root)
+        # Printing the tree is slow, only do it when asked with -v 2
+        if options["verbosity"] > 1:
+            pprint(r.root)
@@ -0,0 +1,20 @@
+# Generated by Django 4.1.7 on 2026-10-16 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pkg_trans", "0003_alter_distribution_js_name_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="distribution",
+            index=models.Index(
+                condition=models.Q(("generated_for__isnull", True)),
+                fields=["python_name_base"],
+                name="dist_pnb_noroot_idx",
+            ),
+        ),
+    ]
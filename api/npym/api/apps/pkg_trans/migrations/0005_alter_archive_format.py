@@ -0,0 +1,45 @@
+# Generated by Django 4.1.7 on 2026-10-16 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("pkg_trans", "0004_distribution_dist_pnb_noroot_idx"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                ALTER TABLE pkg_trans_archive
+                ALTER COLUMN format TYPE smallint
+                USING (CASE format WHEN 'wheel' THEN 0 WHEN 'sdist' THEN 1 END)
+                """,
+                """
+                ALTER TABLE pkg_trans_archive
+                ADD CONSTRAINT pkg_trans_archive_format_check CHECK (format >= 0)
+                """,
+            ],
+            reverse_sql=[
+                """
+                ALTER TABLE pkg_trans_archive
+                DROP CONSTRAINT pkg_trans_archive_format_check
+                """,
+                """
+                ALTER TABLE pkg_trans_archive
+                ALTER COLUMN format TYPE varchar(5)
+                USING (CASE format WHEN 0 THEN 'wheel' WHEN 1 THEN 'sdist' END)
+                """,
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="archive",
+                    name="format",
+                    field=models.PositiveSmallIntegerField(
+                        choices=[(0, "wheel"), (1, "sdist")]
+                    ),
+                ),
+            ],
+        ),
+    ]
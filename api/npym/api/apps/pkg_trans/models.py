@@ -7,6 +7,12 @@ from django.utils.functional import cached_property
 from packaging.version import Version as PyVersion
 from psqlextra.models import PostgresModel
 
+WHEEL_NAME_TRANS = str.maketrans({"-": "_", ".": "_"})
+
+# Parsed Python versions, shared by all Version instances since the same
+# version strings come up over and over again when resolving a tree
+_PY_VERSION_CACHE: dict[str, PyVersion] = {}
+
 
 def return_false():
     """
@@ -44,6 +50,13 @@ class Distribution(UuidPkModel):
         unique_together = [
             ("generated_for", "js_name"),
         ]
+        indexes = [
+            models.Index(
+                fields=["python_name_base"],
+                name="dist_pnb_noroot_idx",
+                condition=models.Q(generated_for__isnull=True),
+            ),
+        ]
 
     js_name = models.CharField(
         max_length=1000,
@@ -127,7 +140,7 @@ class Distribution(UuidPkModel):
         abi_tag: str = "none",
         platform_tag: str = "any",
     ) -> str:
-        name = self.python_name.replace("-", "_").replace(".", "_")
+        name = self.python_name.translate(WHEEL_NAME_TRANS)
         return f"{name}-{version}-{python_tag}-{abi_tag}-{platform_tag}.whl"
 
 
@@ -167,7 +180,10 @@ class Version(UuidPkModel):
         That's useful for things like sorting
         """
 
-        return PyVersion(self.python_version)
+        if self.python_version not in _PY_VERSION_CACHE:
+            _PY_VERSION_CACHE[self.python_version] = PyVersion(self.python_version)
+
+        return _PY_VERSION_CACHE[self.python_version]
 
 
 def upload_to_archive(instance: "Archive", _: str) -> str:
@@ -182,16 +198,17 @@ def upload_to_archive(instance: "Archive", _: str) -> str:
     - Python tag = we'll say that we're compatible with py3
     - ABI tag = we'll say that we're compatible with any ABI
     - Platform tag = we'll say that we're compatible with any platform
+
+    The instance's version and distribution are expected to be already loaded
+    (see select_related() in make_archive()).
     """
 
     translator = instance.translator
     version = instance.version.python_version
     wheel_name = instance.version.distribution.wheel_name(version)
 
-    b1 = instance.hash_sha256[0:2]
-    b2 = instance.hash_sha256[2:4]
-    b3 = instance.hash_sha256[4:6]
-    b4 = instance.hash_sha256[6:8]
+    h = instance.hash_sha256
+    b1, b2, b3, b4 = h[0:2], h[2:4], h[4:6], h[6:8]
 
     return f"distributions/{translator}/{b1}/{b2}/{b3}/{b4}/{wheel_name}"
 
@@ -212,9 +229,9 @@ class Archive(UuidPkModel):
             ("version", "format", "translator"),
         ]
 
-    class Format(models.TextChoices):
-        wheel = "wheel"
-        sdist = "sdist"
+    class Format(models.IntegerChoices):
+        wheel = 0, "wheel"
+        sdist = 1, "sdist"
 
     class Translator(models.TextChoices):
         v1 = "v1"
@@ -224,10 +241,7 @@ class Archive(UuidPkModel):
         on_delete=models.CASCADE,
         related_name="archives",
     )
-    format = models.CharField(
-        max_length=max(len(x[0]) for x in Format.choices),
-        choices=Format.choices,
-    )
+    format = models.PositiveSmallIntegerField(choices=Format.choices)
     translator = models.CharField(
         max_length=max(len(x[0]) for x in Translator.choices),
         choices=Translator.choices,
@@ -1,23 +1,49 @@
+import csv
 import hashlib
-import re
-from collections import defaultdict
+import io
+import os
+import string
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
 from logging import getLogger
-from typing import Dict, MutableMapping, Sequence, TypedDict
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Sequence,
+    TypedDict,
+)
 from urllib.parse import quote
+from uuid import uuid4
 
 import httpx
-import json_stream.httpx
+import orjson
 from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.db import connection
+from django.db.transaction import atomic
 from packaging.version import Version as PyVersion
 from semver import VersionInfo as SemVersion
 
-from .iter import ChunkIterator
 from .models import Distribution
 
-PACKAGE_RE = re.compile(r"^(@(?P<org>[^/]+)/)?(?P<package>.+)$")
-PACKAGE_NON_CHAR = re.compile(r"[^a-zA-Z0-9]+")
-PACKAGE_NUMERIC_BITS = re.compile(r"(?P<prefix>^|-)(?P<number>[0-9])")
+# Read once: going through the lazy settings object for every single name of
+# the registry adds up during the names import
+NPYM_PREFIX = settings.NPYM_PREFIX
+
+DIGITS = frozenset(string.digits)
+
+# Cache alias (see the settings) in which package infos are kept
+PACKAGE_INFO_CACHE = "npm"
+
+# Package infos are revalidated against NPM at each use anyway, this is just
+# how long we keep them around
+PACKAGE_INFO_CACHE_TTL = 60 * 60 * 24 * 7
 
 logger = getLogger(__name__)
 
@@ -45,6 +71,9 @@ class NormName:
     org: str = ""
     original_package: str = field(compare=False, default="")
     original_org: str = field(compare=False, default="")
+    safe_org: str = field(init=False, compare=False, repr=False)
+    safe_package: str = field(init=False, compare=False, repr=False)
+    py_name: str = field(init=False, compare=False, repr=False)
 
     def __post_init__(self):
         """
@@ -52,6 +81,11 @@ class NormName:
         those cases we just go for "undefined" and let the de-duplication
         mechanism of the names import do the job of finding them a unique
         name (a beautiful "undefined.1" or something).
+
+        Then we compute the theoretical Python name for this package (could
+        be changed due to de-duplication phases) once and for all. Python
+        package names cannot start with a number, so those get a "n" in
+        front.
         """
 
         if self.original_org and not self.org:
@@ -60,66 +94,66 @@ class NormName:
         if not self.package:
             self.package = "undefined"
 
-    def make_safe_py_name(self, name: str):
-        """
-        Makes sure that a name is safe to become a Python package name. It
-        cannot start with a number.
+        org = self.org
+        package = self.package
 
-        Parameters
-        ----------
-        name
-            Name you want to transform into a Python package
-        """
+        self.safe_org = f"n{org}" if org and org[0] in DIGITS else org
+        self.safe_package = f"n{package}" if package[0] in DIGITS else package
 
-        if not name:
-            return name
+        if org:
+            self.py_name = f"{NPYM_PREFIX}.{self.safe_org}.{self.safe_package}"
+        else:
+            self.py_name = f"{NPYM_PREFIX}.{self.safe_package}"
 
-        if name[0].isdigit():
-            name = f"n{name}"
 
-        return name
+class NormTable(dict):
+    """
+    Translation table used by _norm_py_name(): ASCII letters are lowercased,
+    digits are kept and any other character becomes a dash.
+    """
 
-    @property
-    def safe_org(self):
-        """
-        An org name that can be a valid package name
-        """
+    def __missing__(self, key):
+        return "-"
 
-        return self.make_safe_py_name(self.org)
 
-    @property
-    def safe_package(self):
-        """
-        A Node package name that can be a valid Python package name
-        """
+NORM_TABLE = NormTable(
+    {ord(c): c.lower() for c in string.ascii_letters + string.digits}
+)
 
-        return self.make_safe_py_name(self.package)
 
-    @property
-    def py_name(self):
-        """
-        Theoretical Python name for this package (could be changed due to
-        de-duplication phases).
-        """
-
-        if self.org:
-            return f"{settings.NPYM_PREFIX}.{self.safe_org}.{self.safe_package}"
+@dataclass(slots=True)
+class PendingDistribution:
+    """
+    A distribution row that is about to be inserted by the names import.
+    There are millions of those so we keep them as light as possible.
+    """
 
-        return f"{settings.NPYM_PREFIX}.{self.safe_package}"
+    js_name: str
+    python_name: str
+    python_name_base: str
+    python_name_searchable: str
+    dedup_seq: int
 
 
+@lru_cache(maxsize=1024)
 def _norm_py_name(package_name: str) -> str:
     """
     Transforms all non-letter characters into dashes, and removes any
     leading or trailing dashes. This should produce a valid Python
     distribution name.
+
+    Package names are all different but the same scopes come back over and
+    over again, hence the small cache.
     """
 
-    package_name = package_name.lower()
-    package_name = PACKAGE_NON_CHAR.sub("-", package_name)
-    package_name = package_name.strip("-")
+    # The table lowercases ASCII letters by itself, but some non-ASCII
+    # characters lowercase into ASCII ones so those need the real thing
+    if not package_name.isascii():
+        package_name = package_name.lower()
 
-    return package_name
+    package_name = package_name.translate(NORM_TABLE)
+
+    return "-".join(filter(None, package_name.split("-")))
 
 
 def searchable_py_name(package_name: str) -> str:
@@ -128,13 +162,12 @@ def searchable_py_name(package_name: str) -> str:
     normalization process but instead of having "-", "_" and "." as special
     characters, we only keep "-" which is the way package managers apparently
     normalize requests.
-    """
 
-    package_name = _norm_py_name(package_name)
-    package_name = package_name.replace("_", "-")
-    package_name = package_name.replace(".", "-")
+    Since _norm_py_name() already turns every non-alphanumeric character
+    into "-", there is nothing left to replace afterwards.
+    """
 
-    return package_name
+    return _norm_py_name(package_name)
 
 
 def importable_py_name(package_name: str) -> str:
@@ -153,14 +186,23 @@ def importable_py_name(package_name: str) -> str:
     return package_name
 
 
+@lru_cache(maxsize=100_000)
 def version_sem_to_py(version: str) -> str:
     """
     Converts as best as possible a SemVer version into a Python version (the
     mapping works in most cases, especially outside weird pre-release naming
     schemes).
+
+    The same versions show up all over dependency trees, hence the cache.
+    Plain releases (no pre-release nor build) are already in their canonical
+    Python form once parsed, so only the others go through PyVersion.
     """
 
     sem = SemVersion.parse(version)
+
+    if not sem.prerelease and not sem.build:
+        return f"{sem.major}.{sem.minor}.{sem.patch}"
+
     py = PyVersion(f"{sem.finalize_version()}{sem.prerelease or ''}{sem.build or ''}")
 
     return f"{py}"
@@ -173,11 +215,29 @@ class Npm:
 
     _instance = None
     NAMES_JSON = "https://raw.githubusercontent.com/nice-registry/all-the-package-names/master/names.json"
+    ABBREVIATED_ACCEPT = (
+        "application/vnd.npm.install-v1+json; q=1.0, application/json; q=0.8"
+    )
 
     def __init__(self):
-        self.client = httpx.Client(base_url="https://registry.npmjs.org/")
+        self.client = httpx.Client(**self._client_kwargs())
         self.async_client = None
 
+    @staticmethod
+    def _client_kwargs():
+        """
+        Common configuration for the sync and async clients. The resolver
+        fires a lot of requests at the registry so we keep a pool of
+        connections over HTTP/2.
+        """
+
+        return dict(
+            base_url="https://registry.npmjs.org/",
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            timeout=httpx.Timeout(30.0, connect=5.0),
+        )
+
     @classmethod
     def instance(cls):
         if not cls._instance:
@@ -192,39 +252,175 @@ class Npm:
         client).
         """
 
-        self.async_client = httpx.AsyncClient(base_url="https://registry.npmjs.org/")
+        self.async_client = httpx.AsyncClient(**self._client_kwargs())
+
+    def _info_cache(self, abbreviated: bool) -> Optional[BaseCache]:
+        """
+        Cache in which a package's info is kept, if any. Only the abbreviated
+        form is cached: that's what the resolver goes through over and over
+        again, while full documents (which can weigh several MB) are only
+        fetched once in a while by the views.
+
+        Parameters
+        ----------
+        abbreviated
+            Abbreviated or full form of the info
+        """
+
+        if abbreviated:
+            return caches[PACKAGE_INFO_CACHE]
+
+    def _info_cache_key(self, package_name: str) -> str:
+        """
+        Cache key for a package's (abbreviated) info
+
+        Parameters
+        ----------
+        package_name
+            Name of the package on NPM
+        """
+
+        return f"npm:info:abbr:{package_name}"
 
-    def get_package_info(self, package_name: str) -> PackageInfo:
+    def _info_headers(self, abbreviated: bool, cached: Optional[Dict]) -> Dict:
         """
-        Retrieves the information about a specific package
+        Headers to send when asking for a package's info. The abbreviated
+        form only contains what's needed to install a package (versions,
+        dependencies, dist) and is way lighter than the full document.
+
+        If we've got a previous copy of that info then we make the request
+        conditional, so that NPM just answers 304 when nothing changed.
+
+        Parameters
+        ----------
+        abbreviated
+            Ask for the abbreviated form
+        cached
+            Previous copy of the info, as stored by _store_info()
         """
 
-        response = self.client.get(f"/{quote(package_name)}")
+        headers = {}
+
+        if abbreviated:
+            headers["Accept"] = self.ABBREVIATED_ACCEPT
+
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        return headers
+
+    def _store_info(self, response: httpx.Response) -> Optional[Dict]:
+        """
+        Returns what should be stored in cache for this response, if anything
+        (we need something to validate the cache against later on).
+
+        Parameters
+        ----------
+        response
+            Response that we just got from NPM
+        """
+
+        etag = response.headers.get("etag", "")
+        last_modified = response.headers.get("last-modified", "")
+
+        if etag or last_modified:
+            return dict(
+                etag=etag,
+                last_modified=last_modified,
+                body=response.content,
+            )
+
+    def get_package_info(
+        self, package_name: str, abbreviated: bool = False
+    ) -> PackageInfo:
+        """
+        Retrieves the information about a specific package. Abbreviated
+        answers are kept in the "npm" cache and revalidated against NPM.
+
+        Parameters
+        ----------
+        package_name
+            Name of the package on NPM
+        abbreviated
+            Get the abbreviated info (no description, readme, etc)
+        """
+
+        store = self._info_cache(abbreviated)
+        key = self._info_cache_key(package_name)
+        cached = store.get(key) if store else None
+
+        response = self.client.get(
+            f"/{quote(package_name)}",
+            headers=self._info_headers(abbreviated, cached),
+        )
+
+        if cached and response.status_code == httpx.codes.NOT_MODIFIED:
+            return orjson.loads(cached["body"])
+
         response.raise_for_status()
 
-        return response.json()
+        if store and (to_store := self._store_info(response)):
+            store.set(key, to_store, PACKAGE_INFO_CACHE_TTL)
+
+        return orjson.loads(response.content)
 
-    async def async_get_package_info(self, package_name: str) -> PackageInfo:
+    async def async_get_package_info(
+        self, package_name: str, abbreviated: bool = False
+    ) -> PackageInfo:
         """
-        Retrieves the information about a specific package
+        Retrieves the information about a specific package. Same as
+        get_package_info() but async.
+
+        Parameters
+        ----------
+        package_name
+            Name of the package on NPM
+        abbreviated
+            Get the abbreviated info (no description, readme, etc)
         """
 
-        response = await self.async_client.get(f"/{quote(package_name)}")
+        store = self._info_cache(abbreviated)
+        key = self._info_cache_key(package_name)
+        cached = await store.aget(key) if store else None
+
+        response = await self.async_client.get(
+            f"/{quote(package_name)}",
+            headers=self._info_headers(abbreviated, cached),
+        )
+
+        if cached and response.status_code == httpx.codes.NOT_MODIFIED:
+            return orjson.loads(cached["body"])
+
         response.raise_for_status()
 
-        return response.json()
+        if store and (to_store := self._store_info(response)):
+            await store.aset(key, to_store, PACKAGE_INFO_CACHE_TTL)
+
+        return orjson.loads(response.content)
 
-    def _make_norm_name(self, package_name: str) -> NormName:
+    @staticmethod
+    def _make_norm_name(package_name: str) -> NormName:
         """
         Generates the normalized name for a given package, which is useful
         for the names importation procedure.
+
+        Every name of the registry only goes through here once per import
+        (in a worker process, see _normalize_chunk()), so there is nothing
+        to gain from caching the results.
         """
 
         package_name = package_name.lower()
-        m = PACKAGE_RE.match(package_name)
+        org, package = "", package_name
+
+        if package_name.startswith("@"):
+            scope, sep, name = package_name[1:].partition("/")
 
-        org = m.group("org") or ""
-        package = m.group("package")
+            if scope and sep and name:
+                org, package = scope, name
 
         return NormName(
             package=_norm_py_name(package),
@@ -233,7 +429,96 @@ class Npm:
             original_org=org,
         )
 
-    def _insert_distributions(self, to_add: Sequence[Dict]) -> None:
+    def _copy_distributions(self, rows: Iterable[PendingDistribution]) -> None:
+        """
+        Inserting hundreds of thousands of rows through INSERT statements is
+        slow, so instead we COPY them into a temporary staging table and then
+        move them into the real table in one statement, letting Postgres
+        skip the ones that would conflict.
+
+        Must be called from within a transaction since the staging table is
+        dropped on commit. When that transaction is an outer one (and ours is
+        just a savepoint), the table from a previous call is still around, so
+        we drop it first.
+        """
+
+        table = Distribution._meta.db_table
+        columns = (
+            "id",
+            "js_name",
+            "python_name",
+            "python_name_base",
+            "python_name_searchable",
+            "dedup_seq",
+            "description",
+            "dependencies",
+        )
+        columns_sql = ", ".join(columns)
+
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+
+        for row in rows:
+            writer.writerow(
+                (
+                    uuid4(),
+                    row.js_name,
+                    row.python_name,
+                    row.python_name_base,
+                    row.python_name_searchable,
+                    row.dedup_seq,
+                    "",
+                    "false",
+                )
+            )
+
+        buf.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS distribution_stage")
+            cursor.execute(
+                f"CREATE TEMP TABLE distribution_stage "
+                f"(LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP"
+            )
+            # The CSV writer leaves the empty description unquoted, which COPY
+            # would read as a NULL and that column doesn't take those
+            cursor.copy_expert(
+                f"COPY distribution_stage ({columns_sql}) FROM STDIN "
+                f"WITH (FORMAT csv, FORCE_NOT_NULL (description))",
+                buf,
+            )
+            cursor.execute(
+                f"INSERT INTO {table} ({columns_sql}) "
+                f"SELECT {columns_sql} FROM distribution_stage "
+                f"ON CONFLICT DO NOTHING"
+            )
+
+    def _load_existing_names(self) -> MutableMapping[str, MutableMapping[str, None]]:
+        """
+        Loads in one go the names of all distributions that are already in
+        DB, indexed by their base Python name and in dedup order. This saves
+        us from querying the DB for conflicts at every single chunk of the
+        import.
+        """
+
+        existing: MutableMapping[str, MutableMapping[str, None]] = {}
+
+        for python_name_base, js_name in (
+            Distribution.objects.filter(generated_for=None)
+            .order_by("dedup_seq")
+            .values_list("python_name_base", "js_name")
+            .iterator(chunk_size=50_000)
+        ):
+            existing.setdefault(python_name_base, {})[js_name] = None
+
+        return existing
+
+    @atomic
+    def _insert_distributions(
+        self,
+        to_add: Sequence[Dict],
+        existing: MutableMapping[str, MutableMapping[str, None]],
+    ) -> None:
         """
         We've received a bulk of names that we've normalized, now we need to
         figure out which ones have conflicts (either from the DB or from the
@@ -242,60 +527,77 @@ class Npm:
         Basically, any two packages that get normalized the same way in Python
         will receive sequential numbers (foo, foo.1, foo.2, etc). It is stored
         in DB so that the order can be kept through time.
+
+        Names already in DB are expected in the existing index (see
+        _load_existing_names()), which gets updated with the names inserted
+        here so that subsequent chunks can see them. The rows are generated
+        on the fly while _copy_distributions() consumes them.
         """
 
-        names_index: MutableMapping[str, MutableMapping[str, bool]] = defaultdict(dict)
+        new_names: MutableMapping[str, MutableMapping[str, str]] = {}
 
-        conflicts_from_db = Distribution.objects.filter(
-            python_name_base__in=[searchable_py_name(d["python_name"]) for d in to_add],
-            generated_for=None,
-        ).order_by("dedup_seq")
-        present_names = set()
+        for distribution in to_add:
+            python_name_base = searchable_py_name(distribution["python_name"])
+            js_name = distribution["js_name"]
 
-        for conflict in conflicts_from_db:
-            names_index[conflict.python_name_base][conflict.js_name] = True
-            present_names.add(conflict.js_name)
+            if js_name not in existing.get(python_name_base, {}):
+                new_names.setdefault(python_name_base, {})[js_name] = distribution[
+                    "python_name"
+                ]
 
-        for distribution in to_add:
-            names_index[searchable_py_name(distribution["python_name"])][
-                distribution["js_name"]
-            ] = True
-
-        to_add_real = []
-
-        for python_name, js_names in names_index.items():
-            if len(js_names) > 1:
-                logger.debug(f"Found conflict for {python_name}: {list(js_names)}")
-
-            for i, js_name in enumerate(js_names):
-                if js_name in present_names:
-                    continue
-
-                norm = self._make_norm_name(js_name)
-
-                if i == 0:
-                    dedup_python_name = norm.py_name
-                else:
-                    h = hashlib.sha256()
-                    h.update(f"{js_name}:{norm.py_name}:{i}".encode("utf-8"))
-                    d = f"x{h.hexdigest()[0:8]}"
-                    dedup_python_name = re.sub(
-                        rf"^({settings.NPYM_PREFIX}\.)?(.*)$",
-                        lambda m: f"{m.group(1)}{d}.{m.group(2)}",
-                        norm.py_name,
+        def iter_rows() -> Iterator[PendingDistribution]:
+            for python_name, js_names in new_names.items():
+                db_names = existing.get(python_name, {})
+
+                if db_names or len(js_names) > 1:
+                    logger.debug(
+                        f"Found conflict for {python_name}: {[*db_names, *js_names]}"
                     )
 
-                to_add_real.append(
-                    dict(
+                for i, (js_name, py_name) in enumerate(
+                    js_names.items(), start=len(db_names)
+                ):
+                    if i == 0:
+                        dedup_python_name = py_name
+                        python_name_searchable = python_name
+                    else:
+                        h = hashlib.blake2s(
+                            f"{js_name}:{py_name}:{i}".encode("utf-8"),
+                            digest_size=4,
+                        )
+                        d = f"x{h.hexdigest()}"
+                        prefix = f"{NPYM_PREFIX}."
+
+                        if py_name.startswith(prefix):
+                            body = py_name.removeprefix(prefix)
+                            dedup_python_name = f"{prefix}{d}.{body}"
+                        else:
+                            dedup_python_name = f"{d}.{py_name}"
+
+                        python_name_searchable = searchable_py_name(dedup_python_name)
+
+                    yield PendingDistribution(
                         js_name=js_name,
                         python_name=dedup_python_name,
-                        python_name_base=searchable_py_name(python_name),
-                        python_name_searchable=searchable_py_name(dedup_python_name),
+                        python_name_base=python_name,
+                        python_name_searchable=python_name_searchable,
                         dedup_seq=i,
                     )
-                )
+                    existing.setdefault(python_name, {})[js_name] = None
+
+        self._copy_distributions(iter_rows())
+
+    def _fetch_names(self) -> List[str]:
+        """
+        Downloads and parses the list of all NPM package names. This goes
+        through the shared client (HTTP/2 and compressed transfer, the list
+        shrinks a lot with gzip), the absolute URL overrides its base URL.
+        """
 
-        Distribution.objects.bulk_insert(to_add_real)
+        response = self.client.get(self.NAMES_JSON, timeout=60)
+        response.raise_for_status()
+
+        return orjson.loads(response.content)
 
     def import_names(self) -> None:
         """
@@ -310,18 +612,51 @@ class Npm:
         names update in real-time but that'll be for much later.
         """
 
-        with httpx.Client() as client, client.stream(
-            "GET",
-            self.NAMES_JSON,
-            timeout=30,
-        ) as response:
-            data = json_stream.httpx.load(response)
+        # Downloading the names and loading the existing ones from the DB
+        # don't compete for anything, so they might as well run side by side
+        with ThreadPoolExecutor(max_workers=1) as fetcher:
+            names_future = fetcher.submit(self._fetch_names)
+            existing = self._load_existing_names()
+            names = names_future.result()
+
+        chunk_size = 50_000
+
+        chunks = (
+            names[start : start + chunk_size]
+            for start in range(0, len(names), chunk_size)
+        )
+
+        workers = os.cpu_count() or 1
+
+        # Chunks are normalized by the pool while the main process inserts
+        # the previous ones. We only keep a few chunks in flight so that the
+        # normalized names don't pile up in memory if the DB is slower, and
+        # we insert them in order so that dedup_seq stays deterministic.
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+
+            for chunk in chunks:
+                pending.append(pool.submit(_normalize_chunk, chunk))
 
-            for chunk in ChunkIterator(data).chunks(10_000):
-                to_add = []
+                if len(pending) > workers:
+                    self._insert_distributions(pending.popleft().result(), existing)
 
-                for name in chunk:
-                    norm_name = self._make_norm_name(name)
-                    to_add.append(dict(js_name=name, python_name=norm_name.py_name))
+            while pending:
+                self._insert_distributions(pending.popleft().result(), existing)
+
+
+def _normalize_chunk(names: Sequence[str]) -> List[Dict]:
+    """
+    Normalizes a chunk of names for Npm.import_names(). This is pure CPU work
+    so it lives at module level in order to be sent to worker processes.
+
+    Parameters
+    ----------
+    names
+        NPM names to normalize
+    """
 
-                self._insert_distributions(to_add)
+    return [
+        dict(js_name=name, python_name=Npm._make_norm_name(name).py_name)
+        for name in names
+    ]
@@ -1,11 +1,13 @@
 import asyncio
 import hashlib
 import json
-from collections import defaultdict
+from collections import deque
 from dataclasses import dataclass, field
-from itertools import product
+from functools import lru_cache
 from typing import (
     Any,
+    Iterable,
+    List,
     Mapping,
     MutableMapping,
     MutableSequence,
@@ -13,11 +15,11 @@ from typing import (
     Sequence,
     Tuple,
 )
+from uuid import UUID
 
 import httpx
 import lark
 from django.urls import reverse
-from packaging.version import Version as PyVersion
 from psqlextra.types import ConflictAction
 from semver import VersionInfo as SemVersion
 from wheel_filename import parse_wheel_filename
@@ -27,11 +29,44 @@ from .npm import Npm, PackageInfo, searchable_py_name, version_sem_to_py
 from .version_man import (
     Range,
     flatten_py_range,
-    intersect_ranges,
+    intersect_range_sets,
     parse_spec,
-    union_ranges,
 )
 
+# How many packages deep_fetch() will download from NPM at the same time
+DEEP_FETCH_CONCURRENCY = 32
+
+
+@lru_cache(maxsize=4096)
+def _parse_spec(spec: str) -> Tuple[Range, ...]:
+    """
+    The same specs (like "^4.0.0") come back all the time when resolving a
+    tree and parsing them with Lark is by far the most expensive part of the
+    resolution, so we cache the parsed ranges.
+
+    Parameters
+    ----------
+    spec
+        Version spec, as found in package.json
+    """
+
+    return parse_spec(spec)
+
+
+@lru_cache(maxsize=65536)
+def _parse_sem_version(version: str) -> SemVersion:
+    """
+    Same versions get tested against a lot of constraints, no need to parse
+    them every single time.
+
+    Parameters
+    ----------
+    version
+        SemVer version string
+    """
+
+    return SemVersion.parse(version)
+
 
 @dataclass
 class VersionInfo:
@@ -66,7 +101,7 @@ class VersionConstraint:
             String from package.json
         """
 
-        return cls(parse_spec(spec))
+        return cls(_parse_spec(spec))
 
     @property
     def has_matches(self):
@@ -89,7 +124,17 @@ class VersionConstraint:
             Version that we want to test
         """
 
-        version = SemVersion.parse(version)
+        return self.accept_sem(_parse_sem_version(version))
+
+    def accept_sem(self, version: SemVersion) -> bool:
+        """
+        Same as accept() but for an already-parsed version
+
+        Parameters
+        ----------
+        version
+            Version that we want to test
+        """
 
         for r in self.ranges:
             if r.contains(version):
@@ -108,12 +153,7 @@ class VersionConstraint:
             Other version constraint to intersect
         """
 
-        out = []
-
-        for a, b in product(self.ranges, other.ranges):
-            out.extend(intersect_ranges([a, b]))
-
-        return VersionConstraint(union_ranges(out))
+        return VersionConstraint(intersect_range_sets(self.ranges, other.ranges))
 
     def flat_py_range(self) -> str:
         """
@@ -127,7 +167,9 @@ class VersionConstraint:
 
 
 def _package_versions(
-    distribution: Distribution, package_info: PackageInfo
+    distribution: Distribution,
+    package_info: PackageInfo,
+    versions: Optional[Sequence[Version]] = None,
 ) -> Mapping[Version, Mapping]:
     """
     Internal backend for both package_versions() and Resolver(). It will
@@ -140,11 +182,17 @@ def _package_versions(
         Distribution object for which we want to get the versions
     package_info
         Package info as returned by NPM
+    versions
+        Versions of this distribution currently in DB, if already loaded
     """
 
     out = {}
 
-    seen = set()
+    if versions is None:
+        versions = distribution.versions.all()
+
+    versions = list(versions)
+    seen = {v.python_version for v in versions}
     to_insert = []
 
     for js_version in package_info["versions"]:
@@ -165,13 +213,17 @@ def _package_versions(
                 )
             )
 
-    Version.objects.on_conflict(
-        ["distribution", "python_version"], ConflictAction.NOTHING
-    ).bulk_insert(to_insert)
+    # Most of the time we already know all the versions, in which case
+    # there is no need to go back to the DB
+    if to_insert:
+        Version.objects.on_conflict(
+            ["distribution", "python_version"], ConflictAction.NOTHING
+        ).bulk_insert(to_insert)
+        versions = list(distribution.versions.all())
 
     for version in sorted(
-        distribution.versions.all(),
-        key=lambda v: PyVersion(v.python_version),
+        versions,
+        key=lambda v: v.parsed_py_version,
         reverse=True,
     ):
         out[version] = package_info["versions"][version.js_version]
@@ -196,31 +248,32 @@ def package_versions(
 
     info = _package_versions(distribution, package_info)
 
-    versions = {}
     out = []
+    hashes = dict(
+        Archive.objects.filter(
+            version__distribution__js_name=package_info["name"],
+            version__distribution__generated_for=None,
+            format=Archive.Format.wheel,
+            translator=Archive.Translator.v1,
+        ).values_list("version__python_version", "hash_sha256")
+    )
 
-    for arch in Archive.objects.filter(
-        version__distribution__js_name=package_info["name"],
-        version__distribution__generated_for=None,
-        format=Archive.Format.wheel,
-        translator=Archive.Translator.v1,
-    ):
-        versions[arch.version.python_version] = arch
+    if signature:
+        # Only the dependencies change from one version to the other
+        signature_base = dict(
+            name=distribution.generated_for.distribution.js_name,
+            version=distribution.generated_for.js_version,
+            path=distribution.js_name,
+        )
 
     for version_obj, version_info in info.items():
         version = version_obj.python_version
-
-        if version in versions:
-            hash_ = versions[version].hash_sha256
-        else:
-            hash_ = ""
+        hash_ = hashes.get(version, "")
 
         if signature:
             computed_signature = hash_data(
                 dict(
-                    name=version_obj.distribution.generated_for.distribution.js_name,
-                    version=version_obj.distribution.generated_for.js_version,
-                    path=distribution.js_name,
+                    signature_base,
                     dependencies=version_info.get("dependencies", {}),
                 )
             )
@@ -246,6 +299,31 @@ def package_versions(
     return out
 
 
+def slim_package_info(package_info: PackageInfo) -> PackageInfo:
+    """
+    The resolver keeps the info of every package of the tree in memory, but
+    only ever looks at the name and at the version/dependencies of each
+    version. This strips everything else (dist, engines, etc), which for big
+    trees adds up to quite some memory.
+
+    Parameters
+    ----------
+    package_info
+        Package info as returned by NPM
+    """
+
+    return dict(
+        name=package_info.get("name", ""),
+        versions={
+            js_version: dict(
+                version=v["version"],
+                dependencies=v.get("dependencies", {}),
+            )
+            for js_version, v in package_info.get("versions", {}).items()
+        },
+    )
+
+
 def hash_data(data: Any, out_length: int = 8) -> str:
     """
     Given a JSON-serializable object, return a SHA-256 hash of it (after
@@ -259,6 +337,9 @@ def hash_data(data: Any, out_length: int = 8) -> str:
         Max length of the expected output
     """
 
+    # Those hashes end up in package names and signatures stored in DB, so
+    # the serialization must stay byte-for-byte the same (which rules out
+    # faster serializers like orjson, their separators are different)
     as_str = json.dumps(data, sort_keys=True, ensure_ascii=True)
     return hashlib.sha256(as_str.encode("utf-8")).hexdigest()[:out_length]
 
@@ -317,9 +398,7 @@ class Node:
     children: MutableSequence["Node"]
     constraint: Optional[VersionConstraint]
     resolution: Optional[NodeResolution] = None
-    _dist_cache: MutableMapping[Distribution, "Node"] = field(
-        default_factory=dict, repr=False
-    )
+    _dist_cache: MutableMapping[UUID, "Node"] = field(default_factory=dict, repr=False)
 
     @property
     def root(self) -> "Node":
@@ -334,22 +413,6 @@ class Node:
 
         return ptr
 
-    @property
-    def ancestors_js_names(self) -> Sequence[str]:
-        """
-        Generates the succession of JS names that you need to figure the path
-        of that module on disk.
-        """
-
-        names = [self.version.distribution.js_name]
-        ptr = self
-
-        while ptr.parent is not None:
-            ptr = ptr.parent
-            names.append(ptr.version.distribution.js_name)
-
-        return names[::-1]
-
     def add_child(self, version: Version, constraint: VersionConstraint) -> "Node":
         """
         Add a child to the current node.
@@ -362,7 +425,7 @@ class Node:
             constraint=constraint,
         )
         self.children.append(node)
-        self._dist_cache[version.distribution] = node
+        self._dist_cache[version.distribution_id] = node
 
         return node
 
@@ -377,13 +440,16 @@ class Node:
             Distribution that you're looking for
         """
 
-        if distribution in self._dist_cache:
-            return self._dist_cache[distribution]
+        pk = distribution.pk
+        ptr = self
 
-        if self.parent is None:
-            return None
-        else:
-            return self.parent.node_for(distribution)
+        while ptr is not None:
+            if pk in ptr._dist_cache:
+                return ptr._dist_cache[pk]
+
+            ptr = ptr.parent
+
+        return None
 
     def ingest(
         self, resolver: "Resolver", current_node: "Node", dep: ResolvedDependency
@@ -474,7 +540,12 @@ class Resolver:
             children=[],
         )
         self._info_cache = {}
-        self._version_cache = {}
+        self._version_cache: MutableMapping[UUID, Mapping[Version, Mapping]] = {}
+        self._known_versions: MutableMapping[UUID, List[Version]] = {}
+        self._dist_cache: MutableMapping[str, Distribution] = {}
+        self._sorted_versions_cache: MutableMapping[
+            str, Sequence[Tuple[SemVersion, Mapping]]
+        ] = {}
 
     async def deep_fetch(self, query: DeepFetchQuery) -> None:
         """
@@ -501,31 +572,43 @@ class Resolver:
         to_fetch = {query}
         fetching = set()
         tasks = []
-        locks = defaultdict(asyncio.Lock)
+        downloads: MutableMapping[str, asyncio.Task] = {}
+        semaphore = asyncio.Semaphore(DEEP_FETCH_CONCURRENCY)
+
+        async def download(js_name: str) -> PackageInfo:
+            async with semaphore:
+                info = await npm.async_get_package_info(js_name, abbreviated=True)
+
+            return slim_package_info(info)
 
         async def fetch_one(q: DeepFetchQuery):
             try:
-                async with locks[q.js_name]:
-                    if q.js_name in self._info_cache:
-                        info = self._info_cache[q.js_name]
-                    else:
-                        info = await npm.async_get_package_info(q.js_name)
+                if q.js_name in self._info_cache:
+                    info = self._info_cache[q.js_name]
+                else:
+                    # The same package can be queried with different specs at
+                    # the same time, they all wait for the same download
+                    if q.js_name not in downloads:
+                        downloads[q.js_name] = loop.create_task(download(q.js_name))
+
+                    try:
+                        info = await downloads[q.js_name]
+                    finally:
+                        # Once done, the info cache takes over
+                        downloads.pop(q.js_name, None)
 
-                    constraint = VersionConstraint.from_spec(q.spec)
                     self._info_cache[q.js_name] = info
 
-                    for version in sorted(
-                        info.get("versions", {}).values(),
-                        key=lambda v: SemVersion.parse(v["version"]),
-                        reverse=True,
-                    ):
-                        if not constraint.accept(version["version"]):
-                            continue
+                constraint = VersionConstraint.from_spec(q.spec)
+
+                for sem, version in self.sorted_versions(q.js_name, info):
+                    if not constraint.accept_sem(sem):
+                        continue
 
-                        for package, spec in version.get("dependencies", {}).items():
-                            to_fetch.add(DeepFetchQuery(js_name=package, spec=spec))
+                    for package, spec in version.get("dependencies", {}).items():
+                        to_fetch.add(DeepFetchQuery(js_name=package, spec=spec))
 
-                        break
+                    break
             except (httpx.HTTPError, lark.exceptions.LarkError, ValueError):
                 pass
 
@@ -540,12 +623,100 @@ class Resolver:
         while to_fetch - fetching:
             await fetch_diff()
 
+    def sorted_versions(
+        self, js_name: str, package_info: PackageInfo
+    ) -> Sequence[Tuple[SemVersion, Mapping]]:
+        """
+        Versions of a package from the most recent to the oldest, along with
+        their parsed SemVer. The same package gets queried with many
+        different specs, so we sort it only once.
+
+        Parameters
+        ----------
+        js_name
+            Name of the package
+        package_info
+            Data that we've got from NPM for this package
+        """
+
+        if js_name not in self._sorted_versions_cache:
+            self._sorted_versions_cache[js_name] = sorted(
+                (
+                    (_parse_sem_version(v["version"]), v)
+                    for v in package_info.get("versions", {}).values()
+                ),
+                key=lambda x: x[0],
+                reverse=True,
+            )
+
+        return self._sorted_versions_cache[js_name]
+
+    def preload_distributions(self, js_names: Iterable[str]) -> None:
+        """
+        Loads in one query the distributions of all the provided packages
+        that aren't in cache yet, instead of getting them one by one while
+        walking the tree.
+
+        Parameters
+        ----------
+        js_names
+            Names of the packages we're going to need
+        """
+
+        missing = [n for n in js_names if n not in self._dist_cache]
+
+        if not missing:
+            return
+
+        for distribution in Distribution.objects.filter(
+            js_name__in=missing,
+            generated_for=None,
+        ):
+            self._dist_cache[distribution.js_name] = distribution
+
+    def preload_versions(self) -> None:
+        """
+        Loads at once the versions of all the distributions that were
+        preloaded, which would otherwise be queried one distribution at a time
+        by get_package_versions().
+        """
+
+        distributions = {d.pk: d for d in self._dist_cache.values()}
+
+        for pk in distributions:
+            self._known_versions.setdefault(pk, [])
+
+        for version in Version.objects.filter(distribution_id__in=distributions):
+            version.distribution = distributions[version.distribution_id]
+            self._known_versions[version.distribution_id].append(version)
+
+    def get_distribution(self, js_name: str) -> Distribution:
+        """
+        Returns the (root) distribution for this JS name, from the cache
+        filled by preload_distributions() if possible.
+
+        Parameters
+        ----------
+        js_name
+            Name of the package
+        """
+
+        if js_name not in self._dist_cache:
+            self._dist_cache[js_name] = Distribution.objects.get(
+                js_name=js_name, generated_for=None
+            )
+
+        return self._dist_cache[js_name]
+
     def get_package_info(self, js_name: str) -> PackageInfo:
         """
         Returns the information from NPM about a package. We'll cache this in
         case we're called in the future. The cache is pre-warmed by
         deep_fetch() before doing anything.
 
+        We only ever look at versions and their dependencies, so the
+        abbreviated info is enough.
+
         Parameters
         ----------
         js_name
@@ -554,7 +725,9 @@ class Resolver:
 
         if js_name not in self._info_cache:
             npm = Npm.instance()
-            self._info_cache[js_name] = npm.get_package_info(js_name)
+            self._info_cache[js_name] = slim_package_info(
+                npm.get_package_info(js_name, abbreviated=True)
+            )
 
         return self._info_cache[js_name]
 
@@ -573,12 +746,14 @@ class Resolver:
             Data that we've got from NPM
         """
 
-        if distribution.real.js_name not in self._version_cache:
-            self._version_cache[distribution.js_name] = _package_versions(
-                distribution, package_info
+        key = distribution.pk
+
+        if key not in self._version_cache:
+            self._version_cache[key] = _package_versions(
+                distribution, package_info, self._known_versions.pop(key, None)
             )
 
-        return self._version_cache[distribution.js_name]
+        return self._version_cache[key]
 
     def find_best_version(
         self, constraint: VersionConstraint, distribution: Distribution
@@ -622,10 +797,12 @@ class Resolver:
             version
         ]
 
+        dependencies = version_info.get("dependencies", {})
+        self.preload_distributions(dependencies.keys())
         out = []
 
-        for package, spec in version_info.get("dependencies", {}).items():
-            distribution = Distribution.objects.get(js_name=package, generated_for=None)
+        for package, spec in dependencies.items():
+            distribution = self.get_distribution(package)
             constraint = VersionConstraint.from_spec(spec)
             best_version = self.find_best_version(constraint, distribution)
 
@@ -651,9 +828,13 @@ class Resolver:
                 )
             ),
         )
-        queue = [self.root]
+        # Once deep_fetch() did its job we know (more or less) all the
+        # packages that are part of the tree
+        self.preload_distributions(self._info_cache.keys())
+        self.preload_versions()
+        queue = deque([self.root])
 
-        while queue and (node := queue.pop(0)):
+        while queue and (node := queue.popleft()):
             for dep in self.get_dependencies(node.version):
                 modified, new_node = node.ingest(self, node, dep)
 
@@ -675,10 +856,10 @@ class Resolver:
         installing this tree.
         """
 
-        queue = [self.root]
+        queue = deque([self.root])
         to_create = []
 
-        while queue and (node := queue.pop(0)):
+        while queue and (node := queue.popleft()):
             dependencies = {}
 
             for child in node.children:
@@ -706,7 +887,7 @@ class Resolver:
                     )
                 )
 
-        Distribution.objects.bulk_create(to_create)
+        Distribution.objects.bulk_create(to_create, batch_size=5000)
 
     def _resolve_nodes(self):
         """
@@ -714,14 +895,19 @@ class Resolver:
         whole tree.
         """
 
-        queue = [self.root]
+        queue = deque([self.root])
 
-        while queue and (node := queue.pop(0)):
+        while queue and (node := queue.popleft()):
             package_info = self.get_package_info(node.version.distribution.js_name)
             version_info = self.get_package_versions(
                 node.version.distribution, package_info
             )[node.version]
-            js_name = "/node_modules/".join(node.ancestors_js_names)
+            js_name = node.version.distribution.js_name
+
+            # Parents are resolved before their children, so their path is
+            # already known
+            if node.parent is not None:
+                js_name = f"{node.parent.resolution.js_name}/node_modules/{js_name}"
             signature_data = {
                 "name": self.root.version.distribution.js_name,
                 "version": self.root.version.js_version,
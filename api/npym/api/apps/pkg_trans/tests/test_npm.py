@@ -1,6 +1,14 @@
+import httpx
 import pytest
+from django.core.cache import caches
 
-from npym.api.apps.pkg_trans.npm import NormName, Npm, _norm_py_name
+from npym.api.apps.pkg_trans.models import Distribution
+from npym.api.apps.pkg_trans.npm import (
+    NormName,
+    Npm,
+    _norm_py_name,
+    _normalize_chunk,
+)
 
 
 @pytest.fixture
@@ -8,11 +16,76 @@ def npm():
     return Npm()
 
 
-def test_get_package_info(npm: Npm):
+@pytest.fixture
+def registry(npm: Npm, settings):
+    """
+    Fake NPM registry, so that tests don't depend on the network. It knows
+    a single package and answers 304 to requests that have the right ETag.
+
+    The package infos cache is swapped for an empty in-memory one.
+    """
+
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+
+        if request.url.path != "/prettier":
+            return httpx.Response(404)
+
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+
+        return httpx.Response(
+            200,
+            json={
+                "name": "prettier",
+                "description": "Prettier is an opinionated code formatter",
+                "versions": {},
+            },
+            headers={"ETag": '"v1"'},
+        )
+
+    npm.client = httpx.Client(
+        transport=httpx.MockTransport(handler), **npm._client_kwargs()
+    )
+    settings.CACHES = {
+        **settings.CACHES,
+        "npm": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "npym-tests-npm",
+        },
+    }
+    caches["npm"].clear()
+
+    return requests
+
+
+def test_get_package_info(npm: Npm, registry):
     info = npm.get_package_info("prettier")
     assert info["name"] == "prettier"
     assert info["description"] == "Prettier is an opinionated code formatter"
 
+    with pytest.raises(httpx.HTTPStatusError):
+        npm.get_package_info("not-prettier")
+
+
+def test_get_package_info_revalidates(npm: Npm, registry):
+    first = npm.get_package_info("prettier", abbreviated=True)
+    second = npm.get_package_info("prettier", abbreviated=True)
+
+    assert first == second
+    assert "If-None-Match" not in registry[0].headers
+    assert registry[1].headers["If-None-Match"] == '"v1"'
+
+
+def test_get_package_info_full_not_cached(npm: Npm, registry):
+    npm.get_package_info("prettier")
+    npm.get_package_info("prettier")
+
+    assert "If-None-Match" not in registry[1].headers
+    assert not caches["npm"].get(npm._info_cache_key("prettier"))
+
 
 def test_norm_py_name():
     assert _norm_py_name("prettier") == "prettier"
@@ -36,3 +109,68 @@ def test_safe_py_name(npm: Npm):
     assert npm._make_norm_name("@42/42").py_name == "npym.n42.n42"
     assert npm._make_norm_name("@_/_").py_name == "npym.undefined.undefined"
     assert npm._make_norm_name("42").py_name == "npym.n42"
+
+
+@pytest.mark.django_db
+def test_insert_distributions(npm: Npm):
+    npm._insert_distributions(_normalize_chunk(["prettier"]), {})
+
+    distribution = Distribution.objects.get(js_name="prettier")
+    assert distribution.python_name == "npym.prettier"
+    assert distribution.python_name_searchable == "npym-prettier"
+    assert distribution.dedup_seq == 0
+    assert distribution.description == ""
+    assert distribution.dependencies is False
+
+
+@pytest.mark.django_db
+def test_insert_distributions_twice_in_transaction(npm: Npm):
+    existing = {}
+
+    npm._insert_distributions(_normalize_chunk(["prettier"]), existing)
+    npm._insert_distributions(_normalize_chunk(["eslint"]), existing)
+
+    assert Distribution.objects.filter(js_name__in=["prettier", "eslint"]).count() == 2
+
+
+@pytest.mark.django_db
+def test_insert_distributions_dedup_across_chunks(npm: Npm):
+    existing = {}
+
+    npm._insert_distributions(_normalize_chunk(["foo.bar"]), existing)
+    npm._insert_distributions(_normalize_chunk(["foo_bar"]), existing)
+
+    first = Distribution.objects.get(js_name="foo.bar")
+    second = Distribution.objects.get(js_name="foo_bar")
+
+    assert first.dedup_seq == 0
+    assert first.python_name == "npym.foo-bar"
+    assert second.dedup_seq == 1
+    assert second.python_name_base == first.python_name_base == "npym-foo-bar"
+    assert second.python_name.startswith("npym.x")
+    assert second.python_name.endswith(".foo-bar")
+    assert existing == {"npym-foo-bar": {"foo.bar": None, "foo_bar": None}}
+
+
+@pytest.mark.django_db
+def test_insert_distributions_skips_existing(npm: Npm):
+    npm._insert_distributions(_normalize_chunk(["prettier"]), {})
+
+    existing = npm._load_existing_names()
+    assert existing == {"npym-prettier": {"prettier": None}}
+
+    npm._insert_distributions(_normalize_chunk(["prettier", "eslint"]), existing)
+
+    assert Distribution.objects.filter(js_name="prettier").count() == 1
+    assert Distribution.objects.get(js_name="prettier").dedup_seq == 0
+    assert Distribution.objects.get(js_name="eslint").dedup_seq == 0
+
+
+@pytest.mark.django_db
+def test_insert_distributions_on_conflict(npm: Npm):
+    npm._insert_distributions(_normalize_chunk(["prettier"]), {})
+
+    # With an empty index the row is sent again, Postgres has to skip it
+    npm._insert_distributions(_normalize_chunk(["prettier"]), {})
+
+    assert Distribution.objects.filter(js_name="prettier").count() == 1
@@ -5,3 +5,4 @@ def test_hash_data():
     assert hash_data("test") == "4d967a30"
     assert hash_data(dict(foo=42)) == hash_data(dict(foo=42))
     assert hash_data(dict(foo=42, bar=True)) == hash_data(dict(bar=True, foo=42))
+    assert hash_data(dict(foo=42, bar=True)) == "b4bbd023"
@@ -1,7 +1,15 @@
+import hashlib
+import io
+import tarfile
+
 from npym.api.apps.pkg_trans.translator import (
+    SOURCE_CHUNK_SIZE,
     DedupMapEntry,
+    copy_and_hash,
     dedup_map,
     dedup_python_key,
+    strip_tar_root,
+    urlsafe_b64encode_nopad,
 )
 
 
@@ -16,3 +24,51 @@ def test_dedup_map():
         "foo_bar_1": DedupMapEntry("foo/bar", "foo_bar_1", 2),
         "foo_bar_2": DedupMapEntry("foo-bar", "foo_bar_2", 3),
     }
+
+
+def test_strip_tar_root():
+    buf = io.BytesIO()
+
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        for name in [
+            "package/package.json",
+            "package/lib/index.js",
+            "package/../evil.js",
+            "other/foo.js",
+        ]:
+            tar.addfile(tarfile.TarInfo(name), io.BytesIO(b""))
+
+        for name, target in [
+            ("package/escdir", "/outside"),
+            ("package/leak", "/etc/hostname"),
+            ("package/up", "../.."),
+        ]:
+            link = tarfile.TarInfo(name)
+            link.type = tarfile.SYMTYPE
+            link.linkname = target
+            tar.addfile(link)
+
+        hard = tarfile.TarInfo("package/hard")
+        hard.type = tarfile.LNKTYPE
+        hard.linkname = "package/leak"
+        tar.addfile(hard)
+
+    buf.seek(0)
+
+    with tarfile.open(fileobj=buf) as tar:
+        assert [m.name for m in strip_tar_root(tar)] == [
+            "package.json",
+            "lib/index.js",
+        ]
+
+
+def test_copy_and_hash():
+    data = bytes(range(256)) * (SOURCE_CHUNK_SIZE // 100)
+    dst = io.BytesIO()
+
+    digest, size = copy_and_hash(io.BytesIO(data), dst)
+
+    expected = urlsafe_b64encode_nopad(hashlib.sha256(data).digest()).decode("ascii")
+    assert digest == f"sha256={expected}"
+    assert size == len(data)
+    assert dst.getvalue() == data
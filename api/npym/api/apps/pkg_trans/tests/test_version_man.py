@@ -1,225 +1,357 @@
+from functools import lru_cache
+
 import pytest
 from semver import VersionInfo as SemVersion
 
 from npym.api.apps.pkg_trans.version_man import (
-    MAX_VER,
-    MIN_VER,
+    BOUND_MAX,
+    BOUND_MIN,
     Bound,
     PartialVersion,
     Range,
     _intersect_ranges,
+    intersect_range_sets,
     intersect_ranges,
     parse_spec,
     sem_range_to_py_range,
 )
 
+# Several tests parse the same specs over and over, no need to run Lark on
+# them every time (results are never mutated by the tests)
+parse_spec = lru_cache(maxsize=None)(parse_spec)
+sem_range_to_py_range = lru_cache(maxsize=None)(sem_range_to_py_range)
+
+# Same goes for versions, the same dozen of them are used everywhere (they are
+# immutable so sharing them is fine)
+V = lru_cache(maxsize=None)(SemVersion)
+
 
 def test_bound():
-    assert Bound(SemVersion(2, 0, 0)) <= Bound(SemVersion(2, 0, 0))
-    assert Bound(SemVersion(2, 0, 0)) < Bound(SemVersion(3, 0, 0))
-    assert Bound(SemVersion(3, 0, 0)) > Bound(SemVersion(2, 0, 0))
-    assert Bound(SemVersion(3, 0, 0)) >= Bound(SemVersion(2, 0, 0))
-    assert Bound(SemVersion(2, 0, 0)) == Bound(SemVersion(2, 0, 0))
-    assert Bound(SemVersion(2, 0, 0)) != Bound(SemVersion(2, 0, 0), inclusive=False)
-    assert Bound(SemVersion(2, 0, 0)) < Bound(SemVersion(2, 0, 0), inclusive=False)
+    assert Bound(V(2, 0, 0)) <= Bound(V(2, 0, 0))
+    assert Bound(V(2, 0, 0)) < Bound(V(3, 0, 0))
+    assert Bound(V(3, 0, 0)) > Bound(V(2, 0, 0))
+    assert Bound(V(3, 0, 0)) >= Bound(V(2, 0, 0))
+    assert Bound(V(2, 0, 0)) == Bound(V(2, 0, 0))
+    assert Bound(V(2, 0, 0)) != Bound(V(2, 0, 0), inclusive=False)
+    assert Bound(V(2, 0, 0)) < Bound(V(2, 0, 0), inclusive=False)
 
 
 def test_partial_version_as_range():
     assert PartialVersion("x").as_range() == Range(
-        min=Bound(MIN_VER),
-        max=Bound(MAX_VER),
+        min=BOUND_MIN,
+        max=BOUND_MAX,
     )
     assert PartialVersion(1, "x").as_range() == Range(
-        min=Bound(SemVersion(1, 0, 0), inclusive=True),
-        max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
+        min=Bound(V(1, 0, 0), inclusive=True),
+        max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
     )
     assert PartialVersion(1, 1, "x").as_range() == Range(
-        min=Bound(SemVersion(1, 1, 0), inclusive=True),
-        max=Bound(SemVersion(1, 2, 0, prerelease="0"), inclusive=False),
+        min=Bound(V(1, 1, 0), inclusive=True),
+        max=Bound(V(1, 2, 0, prerelease="0"), inclusive=False),
     )
     assert PartialVersion(1, 1, 1, "foo", "bar").as_range() == Range(
-        min=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-        max=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-    )
-
-
-def test_partial_version_primitive_ge():
-    assert PartialVersion("x").primitive(">=") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, "x").primitive(">=") == Range(
-        min=Bound(SemVersion(1, 0, 0), inclusive=True),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, 1, "x").primitive(">=") == Range(
-        min=Bound(SemVersion(1, 1, 0), inclusive=True),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, 1, 1, "foo", "bar").primitive(">=") == Range(
-        min=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-        max=Bound(MAX_VER),
+        min=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
+        max=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
     )
 
 
-def test_partial_version_primitive_gt():
-    assert PartialVersion("x").primitive(">") == Range(
-        min=Bound(MAX_VER),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, "x").primitive(">") == Range(
-        min=Bound(SemVersion(2, 0, 0), inclusive=True),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, 1, "x").primitive(">") == Range(
-        min=Bound(SemVersion(1, 2, 0), inclusive=True),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, 1, 1, "foo", "bar").primitive(">") == Range(
-        min=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=False),
-        max=Bound(MAX_VER),
-    )
+PRIMITIVES = [
+    (
+        ">=",
+        ("x",),
+        Range(
+            min=BOUND_MIN,
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        ">=",
+        (1, "x"),
+        Range(
+            min=Bound(V(1, 0, 0), inclusive=True),
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        ">=",
+        (1, 1, "x"),
+        Range(
+            min=Bound(V(1, 1, 0), inclusive=True),
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        ">=",
+        (1, 1, 1, "foo", "bar"),
+        Range(
+            min=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        ">",
+        ("x",),
+        Range(
+            min=BOUND_MAX,
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        ">",
+        (1, "x"),
+        Range(
+            min=Bound(V(2, 0, 0), inclusive=True),
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        ">",
+        (1, 1, "x"),
+        Range(
+            min=Bound(V(1, 2, 0), inclusive=True),
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        ">",
+        (1, 1, 1, "foo", "bar"),
+        Range(
+            min=Bound(V(1, 1, 1, prerelease="foo"), inclusive=False),
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        "<=",
+        ("x",),
+        Range(
+            min=BOUND_MIN,
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        "<=",
+        (1, "x"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        "<=",
+        (1, 1, "x"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(1, 2, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        "<=",
+        (1, 1, 1, "foo", "bar"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
+        ),
+    ),
+    (
+        "<",
+        ("x",),
+        Range(
+            min=BOUND_MIN,
+            max=BOUND_MIN,
+        ),
+    ),
+    (
+        "<",
+        (1, "x"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(1, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        "<",
+        (1, 1, "x"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(1, 1, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        "<",
+        (1, 1, 1, "foo", "bar"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(1, 1, 1, prerelease="foo"), inclusive=False),
+        ),
+    ),
+    (
+        "=",
+        ("x",),
+        Range(
+            min=BOUND_MIN,
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        "=",
+        (1, "x"),
+        Range(
+            min=Bound(V(1, 0, 0), inclusive=True),
+            max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        "=",
+        (1, 1, "x"),
+        Range(
+            min=Bound(V(1, 1, 0), inclusive=True),
+            max=Bound(V(1, 2, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        "=",
+        (1, 1, 1, "foo", "bar"),
+        Range(
+            min=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
+            max=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
+        ),
+    ),
+]
 
 
-def test_partial_version_primitive_le():
-    assert PartialVersion("x").primitive("<=") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, "x").primitive("<=") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, "x").primitive("<=") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(1, 2, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, 1, "foo", "bar").primitive("<=") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-    )
+@pytest.mark.parametrize("op,args,expected", PRIMITIVES)
+def test_partial_version_primitive(op, args, expected):
+    assert PartialVersion(*args).primitive(op) == expected
 
 
-def test_partial_version_primitive_lt():
-    assert PartialVersion("x").primitive("<") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(MIN_VER),
-    )
-    assert PartialVersion(1, "x").primitive("<") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(1, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, "x").primitive("<") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(1, 1, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, 1, "foo", "bar").primitive("<") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=False),
-    )
+TILDES = [
+    (
+        ("x",),
+        Range(
+            min=BOUND_MIN,
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        (0, "x"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(1, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (1, "x"),
+        Range(
+            min=Bound(V(1, 0, 0), inclusive=True),
+            max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (1, 1, "x"),
+        Range(
+            min=Bound(V(1, 1, 0), inclusive=True),
+            max=Bound(V(1, 2, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (1, 1, 1, "foo", "bar"),
+        Range(
+            min=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
+            max=Bound(V(1, 2, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+]
 
 
-def test_partial_version_primitive_eq():
-    assert PartialVersion("x").primitive("=") == Range(
-        min=Bound(MIN_VER),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(1, "x").primitive("=") == Range(
-        min=Bound(SemVersion(1, 0, 0), inclusive=True),
-        max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, "x").primitive("=") == Range(
-        min=Bound(SemVersion(1, 1, 0), inclusive=True),
-        max=Bound(SemVersion(1, 2, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, 1, "foo", "bar").primitive("=") == Range(
-        min=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-        max=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-    )
+@pytest.mark.parametrize("args,expected", TILDES)
+def test_partial_version_tilde(args, expected):
+    assert PartialVersion(*args).tilde() == expected
 
 
-# noinspection DuplicatedCode
-def test_partial_version_tilde():
-    assert PartialVersion("x").tilde() == Range(
-        min=Bound(MIN_VER),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(0, "x").tilde() == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(1, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, "x").tilde() == Range(
-        min=Bound(SemVersion(1, 0, 0), inclusive=True),
-        max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, "x").tilde() == Range(
-        min=Bound(SemVersion(1, 1, 0), inclusive=True),
-        max=Bound(SemVersion(1, 2, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, 1, "foo", "bar").tilde() == Range(
-        min=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-        max=Bound(SemVersion(1, 2, 0, prerelease="0"), inclusive=False),
-    )
+CARETS = [
+    (
+        ("x",),
+        Range(
+            min=BOUND_MIN,
+            max=BOUND_MAX,
+        ),
+    ),
+    (
+        (0, "x"),
+        Range(
+            min=BOUND_MIN,
+            max=Bound(V(1, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (0, 1, "x"),
+        Range(
+            min=Bound(V(0, 1, 0), inclusive=True),
+            max=Bound(V(0, 2, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (0, 1, 1, "foo", "bar"),
+        Range(
+            min=Bound(V(0, 1, 1, prerelease="foo"), inclusive=True),
+            max=Bound(V(0, 2, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (1, "x"),
+        Range(
+            min=Bound(V(1, 0, 0), inclusive=True),
+            max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (1, 1, "x"),
+        Range(
+            min=Bound(V(1, 1, 0), inclusive=True),
+            max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+    (
+        (1, 1, 1, "foo", "bar"),
+        Range(
+            min=Bound(V(1, 1, 1, prerelease="foo"), inclusive=True),
+            max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+        ),
+    ),
+]
 
 
-# noinspection DuplicatedCode
-def test_partial_version_caret():
-    assert PartialVersion("x").caret() == Range(
-        min=Bound(MIN_VER),
-        max=Bound(MAX_VER),
-    )
-    assert PartialVersion(0, "x").caret() == Range(
-        min=Bound(MIN_VER),
-        max=Bound(SemVersion(1, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(0, 1, "x").caret() == Range(
-        min=Bound(SemVersion(0, 1, 0), inclusive=True),
-        max=Bound(SemVersion(0, 2, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(0, 1, 1, "foo", "bar").caret() == Range(
-        min=Bound(SemVersion(0, 1, 1, prerelease="foo"), inclusive=True),
-        max=Bound(SemVersion(0, 2, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, "x").caret() == Range(
-        min=Bound(SemVersion(1, 0, 0), inclusive=True),
-        max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, "x").caret() == Range(
-        min=Bound(SemVersion(1, 1, 0), inclusive=True),
-        max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-    )
-    assert PartialVersion(1, 1, 1, "foo", "bar").caret() == Range(
-        min=Bound(SemVersion(1, 1, 1, prerelease="foo"), inclusive=True),
-        max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-    )
+@pytest.mark.parametrize("args,expected", CARETS)
+def test_partial_version_caret(args, expected):
+    assert PartialVersion(*args).caret() == expected
 
 
 def test_intersect_ranges():
     assert _intersect_ranges(
         a=Range(
-            min=Bound(SemVersion(1, 0, 0)),
-            max=Bound(SemVersion(2, 0, 0)),
+            min=Bound(V(1, 0, 0)),
+            max=Bound(V(2, 0, 0)),
         ),
         b=Range(
-            min=Bound(SemVersion(1, 0, 0)),
-            max=Bound(SemVersion(2, 0, 0)),
+            min=Bound(V(1, 0, 0)),
+            max=Bound(V(2, 0, 0)),
         ),
     ) == [
         Range(
-            min=Bound(SemVersion(1, 0, 0)),
-            max=Bound(SemVersion(2, 0, 0)),
+            min=Bound(V(1, 0, 0)),
+            max=Bound(V(2, 0, 0)),
         )
     ]
 
     assert (
         _intersect_ranges(
             a=Range(
-                min=Bound(SemVersion(1, 0, 0)),
-                max=Bound(SemVersion(2, 0, 0)),
+                min=Bound(V(1, 0, 0)),
+                max=Bound(V(2, 0, 0)),
             ),
             b=Range(
-                min=Bound(SemVersion(2, 0, 0), inclusive=False),
-                max=Bound(SemVersion(3, 0, 0)),
+                min=Bound(V(2, 0, 0), inclusive=False),
+                max=Bound(V(3, 0, 0)),
             ),
         )
         == []
@@ -227,235 +359,319 @@ def test_intersect_ranges():
 
     assert _intersect_ranges(
         a=Range(
-            min=Bound(SemVersion(1, 0, 0)),
-            max=Bound(SemVersion(2, 0, 0)),
+            min=Bound(V(1, 0, 0)),
+            max=Bound(V(2, 0, 0)),
         ),
         b=Range(
-            min=Bound(SemVersion(2, 0, 0)),
-            max=Bound(SemVersion(3, 0, 0)),
+            min=Bound(V(2, 0, 0)),
+            max=Bound(V(3, 0, 0)),
         ),
     ) == [
         Range(
-            min=Bound(SemVersion(2, 0, 0), inclusive=True),
-            max=Bound(SemVersion(2, 0, 0), inclusive=True),
+            min=Bound(V(2, 0, 0), inclusive=True),
+            max=Bound(V(2, 0, 0), inclusive=True),
         )
     ]
 
     assert intersect_ranges(
         [
-            Range(Bound(SemVersion(1, 0, 0), inclusive=False), Bound(MAX_VER)),
+            Range(Bound(V(1, 0, 0), inclusive=False), BOUND_MAX),
             Range(
-                Bound(MIN_VER),
-                Bound(SemVersion(4, 0, 0, prerelease="0"), inclusive=False),
+                BOUND_MIN,
+                Bound(V(4, 0, 0, prerelease="0"), inclusive=False),
             ),
         ]
-    ) == [
+    ) == (
         Range(
-            min=Bound(SemVersion(1, 0, 0), inclusive=False),
-            max=Bound(SemVersion(4, 0, 0, prerelease="0"), inclusive=False),
+            min=Bound(V(1, 0, 0), inclusive=False),
+            max=Bound(V(4, 0, 0, prerelease="0"), inclusive=False),
         ),
-    ]
+    )
 
     assert intersect_ranges(
         [
-            Range(Bound(SemVersion(1, 0, 0), inclusive=False), Bound(MAX_VER)),
-            Range(Bound(MIN_VER), Bound(SemVersion(4, 0, 0), inclusive=False)),
+            Range(Bound(V(1, 0, 0), inclusive=False), BOUND_MAX),
+            Range(BOUND_MIN, Bound(V(4, 0, 0), inclusive=False)),
             Range(
-                Bound(MIN_VER),
-                Bound(SemVersion(3, 5, 0, prerelease="0"), inclusive=False),
+                BOUND_MIN,
+                Bound(V(3, 5, 0, prerelease="0"), inclusive=False),
             ),
-            Range(Bound(SemVersion(1, 2, 0), inclusive=False), Bound(MAX_VER)),
+            Range(Bound(V(1, 2, 0), inclusive=False), BOUND_MAX),
         ]
-    ) == [
+    ) == (
         Range(
-            min=Bound(SemVersion(1, 2, 0), inclusive=False),
-            max=Bound(SemVersion(3, 5, 0, prerelease="0"), inclusive=False),
+            min=Bound(V(1, 2, 0), inclusive=False),
+            max=Bound(V(3, 5, 0, prerelease="0"), inclusive=False),
         ),
-    ]
+    )
 
 
-def test_parse_spec():
-    assert parse_spec(">1 <=3 <=3.4 >1.2 || 5.x") == [
+def test_intersect_range_sets():
+    assert intersect_range_sets(
+        parse_spec("^1.0.0 || ^3.0.0"),
+        parse_spec(">=1.5.0 <3.2.0"),
+    ) == [
         Range(
-            min=Bound(SemVersion(2, 0, 0), inclusive=True),
-            max=Bound(SemVersion(3, 5, 0, prerelease="0"), inclusive=False),
+            min=Bound(V(1, 5, 0)),
+            max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
         ),
         Range(
-            min=Bound(SemVersion(5, 0, 0)),
-            max=Bound(SemVersion(6, 0, 0, prerelease="0"), inclusive=False),
+            min=Bound(V(3, 0, 0)),
+            max=Bound(V(3, 2, 0), inclusive=False),
         ),
     ]
 
-    assert parse_spec("1.x || 2.x || 3.x") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 0), inclusive=True),
-            max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
+    assert intersect_range_sets(parse_spec("^1.0.0"), parse_spec("^2.0.0")) == []
+    assert intersect_range_sets(parse_spec("^1.0.0"), []) == []
+
+
+PARSE_SPEC = [
+    (
+        ">1 <=3 <=3.4 >1.2 || 5.x",
+        (
+            Range(
+                min=Bound(V(2, 0, 0), inclusive=True),
+                max=Bound(V(3, 5, 0, prerelease="0"), inclusive=False),
+            ),
+            Range(
+                min=Bound(V(5, 0, 0)),
+                max=Bound(V(6, 0, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-        Range(
-            min=Bound(SemVersion(2, 0, 0), inclusive=True),
-            max=Bound(SemVersion(3, 0, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "1.x || 2.x || 3.x",
+        (
+            Range(
+                min=Bound(V(1, 0, 0), inclusive=True),
+                max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+            ),
+            Range(
+                min=Bound(V(2, 0, 0), inclusive=True),
+                max=Bound(V(3, 0, 0, prerelease="0"), inclusive=False),
+            ),
+            Range(
+                min=Bound(V(3, 0, 0), inclusive=True),
+                max=Bound(V(4, 0, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-        Range(
-            min=Bound(SemVersion(3, 0, 0), inclusive=True),
-            max=Bound(SemVersion(4, 0, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "1.0.x-a.b+d.e",
+        (
+            Range(
+                min=Bound(V(1, 0, 0), inclusive=True),
+                max=Bound(V(1, 1, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("1.0.x-a.b+d.e") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 0), inclusive=True),
-            max=Bound(SemVersion(1, 1, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "~1",
+        (
+            Range(
+                min=Bound(V(1, 0, 0), inclusive=True),
+                max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("~1") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 0), inclusive=True),
-            max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-        )
-    ]
-
-    assert parse_spec("~1.1") == [
-        Range(
-            min=Bound(SemVersion(1, 1, 0), inclusive=True),
-            max=Bound(SemVersion(1, 2, 0, prerelease="0"), inclusive=False),
-        )
-    ]
-
-    assert parse_spec("^1") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 0), inclusive=True),
-            max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-        )
-    ]
-
-    assert parse_spec("^0.1") == [
-        Range(
-            min=Bound(SemVersion(0, 1, 0), inclusive=True),
-            max=Bound(SemVersion(0, 2, 0, prerelease="0"), inclusive=False),
-        )
-    ]
-
-    assert parse_spec("^1.1") == [
-        Range(
-            min=Bound(SemVersion(1, 1, 0), inclusive=True),
-            max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
-        )
-    ]
-
-    assert parse_spec("1.x - 2.x") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 0), inclusive=True),
-            max=Bound(SemVersion(3, 0, 0, prerelease="0"), inclusive=False),
-        )
-    ]
-
-    assert parse_spec("1.0.0 - 2.9999.9999") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 0)),
-            max=Bound(SemVersion(2, 9999, 9999)),
+    ),
+    (
+        "~1.1",
+        (
+            Range(
+                min=Bound(V(1, 1, 0), inclusive=True),
+                max=Bound(V(1, 2, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec(">=1.0.2 <2.1.2") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 2)),
-            max=Bound(SemVersion(2, 1, 2), inclusive=False),
+    ),
+    (
+        "^1",
+        (
+            Range(
+                min=Bound(V(1, 0, 0), inclusive=True),
+                max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec(">1.0.2 <=2.3.4") == [
-        Range(
-            min=Bound(SemVersion(1, 0, 2), inclusive=False),
-            max=Bound(SemVersion(2, 3, 4)),
+    ),
+    (
+        "^0.1",
+        (
+            Range(
+                min=Bound(V(0, 1, 0), inclusive=True),
+                max=Bound(V(0, 2, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("2.0.1") == [
-        Range(
-            min=Bound(SemVersion(2, 0, 1)),
-            max=Bound(SemVersion(2, 0, 1)),
+    ),
+    (
+        "^1.1",
+        (
+            Range(
+                min=Bound(V(1, 1, 0), inclusive=True),
+                max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("<1.0.0 || >=2.3.1 <2.4.5 || >=2.5.2 <3.0.0") == [
-        Range(
-            max=Bound(SemVersion(1, 0, 0), inclusive=False),
+    ),
+    (
+        "1.x - 2.x",
+        (
+            Range(
+                min=Bound(V(1, 0, 0), inclusive=True),
+                max=Bound(V(3, 0, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-        Range(
-            min=Bound(SemVersion(2, 3, 1)),
-            max=Bound(SemVersion(2, 4, 5), inclusive=False),
+    ),
+    (
+        "1.0.0 - 2.9999.9999",
+        (
+            Range(
+                min=Bound(V(1, 0, 0)),
+                max=Bound(V(2, 9999, 9999)),
+            ),
         ),
-        Range(
-            min=Bound(SemVersion(2, 5, 2)),
-            max=Bound(SemVersion(3, 0, 0), inclusive=False),
+    ),
+    (
+        ">=1.0.2 <2.1.2",
+        (
+            Range(
+                min=Bound(V(1, 0, 2)),
+                max=Bound(V(2, 1, 2), inclusive=False),
+            ),
         ),
-    ]
-
-    with pytest.raises(ValueError):
-        parse_spec("http://asdf.com/asdf.tar.gz")
-
-    assert parse_spec("~1.2") == [
-        Range(
-            min=Bound(SemVersion(1, 2, 0), inclusive=True),
-            max=Bound(SemVersion(1, 3, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        ">1.0.2 <=2.3.4",
+        (
+            Range(
+                min=Bound(V(1, 0, 2), inclusive=False),
+                max=Bound(V(2, 3, 4)),
+            ),
         ),
-    ]
-
-    assert parse_spec("~1.2.3") == [
-        Range(
-            min=Bound(SemVersion(1, 2, 3), inclusive=True),
-            max=Bound(SemVersion(1, 3, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "2.0.1",
+        (
+            Range(
+                min=Bound(V(2, 0, 1)),
+                max=Bound(V(2, 0, 1)),
+            ),
         ),
-    ]
-
-    assert parse_spec("2.x") == [
-        Range(
-            min=Bound(SemVersion(2, 0, 0), inclusive=True),
-            max=Bound(SemVersion(3, 0, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "<1.0.0 || >=2.3.1 <2.4.5 || >=2.5.2 <3.0.0",
+        (
+            Range(
+                max=Bound(V(1, 0, 0), inclusive=False),
+            ),
+            Range(
+                min=Bound(V(2, 3, 1)),
+                max=Bound(V(2, 4, 5), inclusive=False),
+            ),
+            Range(
+                min=Bound(V(2, 5, 2)),
+                max=Bound(V(3, 0, 0), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("3.3.x") == [
-        Range(
-            min=Bound(SemVersion(3, 3, 0), inclusive=True),
-            max=Bound(SemVersion(3, 4, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "~1.2",
+        (
+            Range(
+                min=Bound(V(1, 2, 0), inclusive=True),
+                max=Bound(V(1, 3, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("~0.1.2") == [
-        Range(
-            min=Bound(SemVersion(0, 1, 2), inclusive=True),
-            max=Bound(SemVersion(0, 2, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "~1.2.3",
+        (
+            Range(
+                min=Bound(V(1, 2, 3), inclusive=True),
+                max=Bound(V(1, 3, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("~1.1.2") == [
-        Range(
-            min=Bound(SemVersion(1, 1, 2), inclusive=True),
-            max=Bound(SemVersion(1, 2, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "2.x",
+        (
+            Range(
+                min=Bound(V(2, 0, 0), inclusive=True),
+                max=Bound(V(3, 0, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("^0.1.2") == [
-        Range(
-            min=Bound(SemVersion(0, 1, 2), inclusive=True),
-            max=Bound(SemVersion(0, 2, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "3.3.x",
+        (
+            Range(
+                min=Bound(V(3, 3, 0), inclusive=True),
+                max=Bound(V(3, 4, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
-
-    assert parse_spec("^1.1.2") == [
-        Range(
-            min=Bound(SemVersion(1, 1, 2), inclusive=True),
-            max=Bound(SemVersion(2, 0, 0, prerelease="0"), inclusive=False),
+    ),
+    (
+        "~0.1.2",
+        (
+            Range(
+                min=Bound(V(0, 1, 2), inclusive=True),
+                max=Bound(V(0, 2, 0, prerelease="0"), inclusive=False),
+            ),
         ),
-    ]
+    ),
+    (
+        "~1.1.2",
+        (
+            Range(
+                min=Bound(V(1, 1, 2), inclusive=True),
+                max=Bound(V(1, 2, 0, prerelease="0"), inclusive=False),
+            ),
+        ),
+    ),
+    (
+        "^0.1.2",
+        (
+            Range(
+                min=Bound(V(0, 1, 2), inclusive=True),
+                max=Bound(V(0, 2, 0, prerelease="0"), inclusive=False),
+            ),
+        ),
+    ),
+    (
+        "^1.1.2",
+        (
+            Range(
+                min=Bound(V(1, 1, 2), inclusive=True),
+                max=Bound(V(2, 0, 0, prerelease="0"), inclusive=False),
+            ),
+        ),
+    ),
+    (
+        ">=1.0.0-rc.1",
+        (
+            Range(
+                min=Bound(V(1, 0, 0, prerelease="rc.1"), inclusive=True),
+                max=BOUND_MAX,
+            ),
+        ),
+    ),
+]
 
-    with pytest.raises(ValueError):
-        parse_spec("latest")
 
+@pytest.mark.parametrize("spec,expected", PARSE_SPEC)
+def test_parse_spec(spec, expected):
+    assert parse_spec(spec) == expected
+
+
+INVALID_SPECS = [
+    "http://asdf.com/asdf.tar.gz",
+    "latest",
+    ">=1.0.0 ",
+    "file:../dyl",
+]
+
+
+@pytest.mark.parametrize("spec", INVALID_SPECS)
+def test_parse_spec_invalid(spec):
     with pytest.raises(ValueError):
-        parse_spec("file:../dyl")
+        parse_spec(spec)
 
 
 def test_sem_convert():
@@ -468,16 +684,33 @@ def test_sem_convert():
     assert sem_range_to_py_range(">2 >4 <8 || 5.x") == ">=5.0.0,<8.0.0"
 
 
-def test_range_ver_compare():
-    assert parse_spec("1.0.0")[0].contains(SemVersion.parse("1.0.0"))
-    assert not parse_spec("1.0.0")[0].contains(SemVersion.parse("1.0.1"))
+# Versions are parsed once here rather than in each assertion
+RANGE_VER_COMPARE = [
+    ("1.0.0", SemVersion.parse("1.0.0"), True),
+    ("1.0.0", SemVersion.parse("1.0.1"), False),
+    ("1.x", SemVersion.parse("1.0.0-beta.1"), False),
+    ("1.x", SemVersion.parse("1.0.0"), True),
+    ("1.x", SemVersion.parse("1.2.0"), True),
+    ("1.x", SemVersion.parse("2.0.0"), False),
+    ("~1.2.3", SemVersion.parse("1.2.0"), False),
+    ("~1.2.3", SemVersion.parse("1.2.3"), True),
+    ("~1.2.3", SemVersion.parse("1.2.42"), True),
+    ("~1.2.3", SemVersion.parse("1.3.0"), False),
+]
+
+
+@pytest.mark.parametrize("spec,version,expected", RANGE_VER_COMPARE)
+def test_range_ver_compare(spec, version, expected):
+    assert parse_spec(spec)[0].contains(version) is expected
+
+
+def test_range_contains_shared_bound():
+    bound = Bound(SemVersion.parse("1.0.0-rc.1"))
+    shared = Range(min=bound, max=bound)
+    distinct = Range(min=bound, max=Bound(SemVersion.parse("1.0.0-rc.1")))
 
-    assert not parse_spec("1.x")[0].contains(SemVersion.parse("1.0.0-beta.1"))
-    assert parse_spec("1.x")[0].contains(SemVersion.parse("1.0.0"))
-    assert parse_spec("1.x")[0].contains(SemVersion.parse("1.2.0"))
-    assert not parse_spec("1.x")[0].contains(SemVersion.parse("2.0.0"))
+    assert shared == distinct
 
-    assert not parse_spec("~1.2.3")[0].contains(SemVersion.parse("1.2.0"))
-    assert parse_spec("~1.2.3")[0].contains(SemVersion.parse("1.2.3"))
-    assert parse_spec("~1.2.3")[0].contains(SemVersion.parse("1.2.42"))
-    assert not parse_spec("~1.2.3")[0].contains(SemVersion.parse("1.3.0"))
+    for version in ["0.9.0", "1.0.0", "1.0.1"]:
+        v = SemVersion.parse(version)
+        assert shared.contains(v) is distinct.contains(v) is False
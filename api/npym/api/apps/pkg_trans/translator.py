@@ -2,41 +2,156 @@ import base64
 import hashlib
 import json
 import re
-import shutil
 import tarfile
 import zipfile
 from dataclasses import dataclass
-from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import Callable, Generic, Mapping, MutableMapping, Sequence, Tuple, TypeVar
-
-import httpx
+from pathlib import Path, PurePosixPath
+from tempfile import SpooledTemporaryFile, TemporaryDirectory
+from typing import (
+    Callable,
+    Generic,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 
 from .models import Distribution, Version
-from .npm import importable_py_name
+from .npm import Npm, importable_py_name
 from .resolver import Resolver
 from .version_man import sem_range_to_py_range
 
+# Tarballs are downloaded by chunks of this size
+SOURCE_CHUNK_SIZE = 128 * 1024
+
+# Up to this size, the source tarball is kept in memory instead of being
+# written to the working directory
+SOURCE_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Size of the buffer used to read files when hashing them
+DIGEST_BUFFER_SIZE = 1024 * 1024
+
+# Deflate level for the wheels. Going up to 9 costs a lot more CPU for
+# barely smaller files.
+WHEEL_COMPRESS_LEVEL = 6
+
+# Patterns used to clean up names and metadata of every translated package
+NON_PRINTABLE = re.compile(r"([^\x20-\x7e]|[\r\n])+")
+NON_ALNUM = re.compile(r"[^a-z0-9]+")
+NON_MODULE_CHARS = re.compile(r"[^a-z0-9.]+")
+
+# Those files are already compressed, deflating them again is a waste of time
+STORED_SUFFIXES = frozenset(
+    {
+        ".br",
+        ".gif",
+        ".gz",
+        ".jpeg",
+        ".jpg",
+        ".png",
+        ".tgz",
+        ".webp",
+        ".woff",
+        ".woff2",
+        ".zip",
+    }
+)
+
 
 def file_digest(file, algorithm):
     """
-    Computes the hash of a given file
+    Computes the hash of a given file. Reads are done into a single reusable
+    buffer, big enough for the hashing itself to be the bottleneck and not
+    the Python loop around it (hashlib.file_digest() does the same thing but
+    it only comes with Python 3.11).
     """
 
     h = hashlib.new(algorithm)
+    buf = bytearray(DIGEST_BUFFER_SIZE)
+    view = memoryview(buf)
 
-    while buf := file.read(4096):
-        h.update(buf)
+    while size := file.readinto(buf):
+        h.update(view[:size])
 
     return h
 
 
+def copy_and_hash(src, dst) -> Tuple[str, int]:
+    """
+    Copies a file into another one by chunks, hashing it on the way. Returns
+    the hash (as expected in a wheel's RECORD) and the size of the content,
+    without ever having the whole file in memory.
+
+    Parameters
+    ----------
+    src
+        Binary file to read from
+    dst
+        Binary file to write into
+    """
+
+    h = hashlib.sha256()
+    total = 0
+    buf = bytearray(SOURCE_CHUNK_SIZE)
+    view = memoryview(buf)
+
+    while size := src.readinto(buf):
+        chunk = view[:size]
+        h.update(chunk)
+        dst.write(chunk)
+        total += size
+
+    return f"sha256={urlsafe_b64encode_nopad(h.digest()).decode('ascii')}", total
+
+
+def strip_tar_root(tar: tarfile.TarFile) -> Iterator[tarfile.TarInfo]:
+    """
+    Goes through the members of the tarball, only keeping those inside of
+    the first directory found and renaming them relatively to it. Members
+    trying to escape that directory are skipped, and so is anything that
+    isn't a regular file or a directory: links could point outside of the
+    extraction directory (or get written through) and NPM doesn't pack them
+    anyway.
+
+    It's a generator so that members get extracted as they are read, in a
+    single pass through the (compressed) tarball.
+
+    Parameters
+    ----------
+    tar
+        Opened tarball to go through
+    """
+
+    root = None
+
+    for member in tar:
+        if not (member.isreg() or member.isdir()):
+            continue
+
+        parts = PurePosixPath(member.name).parts
+
+        if root is None:
+            if len(parts) > 1 or member.isdir():
+                root = parts[0]
+            else:
+                continue
+
+        if len(parts) < 2 or parts[0] != root or ".." in parts:
+            continue
+
+        member.name = "/".join(parts[1:])
+
+        yield member
+
+
 def sanitize(name: str) -> str:
     """
     Drop all new lines, non-printable characters, etc.
     """
 
-    return re.sub(r"([^\x20-\x7e]|[\r\n])+", " ", f"{name}")
+    return NON_PRINTABLE.sub(" ", f"{name}")
 
 
 def urlsafe_b64encode_nopad(data):
@@ -74,7 +189,7 @@ def dedup_python_key(k: str, i: int) -> str:
         Index of that key's occurrence
     """
 
-    k = re.sub(r"[^a-z0-9]+", "_", k.lower()).strip("_")
+    k = NON_ALNUM.sub("_", k.lower()).strip("_")
 
     if i == 0:
         return k
@@ -129,22 +244,8 @@ class PackageTranslator:
         self.version = version
         self._work_dir = None
         self.work_dir = None
-
-    @property
-    def source_path(self):
-        """
-        Where we download the source NPM package
-        """
-
-        return self.work_dir / "source.tgz"
-
-    @property
-    def source_dir(self):
-        """
-        Where we uncompress the NPM source package
-        """
-
-        return self.work_dir / "source"
+        self._source = None
+        self._source_digest = None
 
     @property
     def wheel_dir(self):
@@ -206,77 +307,68 @@ class PackageTranslator:
         computes the location of this module.
         """
 
-        py_module = re.sub("[^a-z0-9.]+", "_", self.distribution.python_name)
+        py_module = NON_MODULE_CHARS.sub("_", self.distribution.python_name)
         py_module = py_module.replace(".", "/")
 
         return self.wheel_dir / py_module
 
     def _download_source(self):
         """
-        Downloads the source NPM package
+        Downloads the source NPM package. It stays in memory unless it's big,
+        and it gets hashed while downloading so that we don't have to read it
+        all over again to check its integrity.
+
+        Tarballs are served by the registry, so we go through the Npm client
+        and its pool of HTTP/2 connections instead of doing a new handshake
+        for every single package.
         """
 
         url = self.version_info["dist"]["tarball"]
+        algo = self.version_info["dist"]["integrity"].split("-", 1)[0]
+        h = hashlib.new(algo)
 
-        with self.source_path.open("wb") as f, httpx.Client() as client:
-            with client.stream("GET", url) as stream:
-                for data in stream.iter_bytes():
-                    f.write(data)
+        self._source = SpooledTemporaryFile(
+            max_size=SOURCE_SPOOL_SIZE, dir=self.work_dir
+        )
+
+        with Npm.instance().client.stream("GET", url) as stream:
+            for data in stream.iter_bytes(SOURCE_CHUNK_SIZE):
+                h.update(data)
+                self._source.write(data)
+
+        self._source_digest = h.digest()
 
     def _check_source_integrity(self):
         """
         Making sure that the hash checks out
         """
 
-        algo, b64_hash = self.version_info["dist"]["integrity"].split("-", 1)
-
-        with self.source_path.open("rb") as f:
-            digest = file_digest(f, algo)
-
+        _, b64_hash = self.version_info["dist"]["integrity"].split("-", 1)
         expected_digest = base64.b64decode(b64_hash)
 
-        if digest.digest() != expected_digest:
+        if self._source_digest != expected_digest:
             raise ValueError("Source integrity check failed")
 
     def _extract_source(self):
         """
-        The NPM source is a tarball. We'll extract it in work_dir / source.
-        """
-
-        self.source_dir.mkdir(parents=True, exist_ok=True)
-
-        with tarfile.open(self.source_path) as tar:
-            tar.extractall(self.source_dir)
-
-    def _copy_source(self):
-        """
-        We copy the source from "work_dir/source/<package>" to the wheel
-        by putting everything in
+        The NPM source is a tarball, in which everything is inside of a first
+        directory (usually "package"). We extract the content of that
+        directory straight into the wheel, in
         "work_dir/wheel/npym/node_modules/<package_name>".
-
-        The <package> directory is the first directory found in the tarball.
         """
 
         self.npm_package_dir.mkdir(parents=True, exist_ok=True)
+        self._source.seek(0)
 
-        for f in self.source_dir.iterdir():
-            if f.is_dir():
-                first_dir = f
-                shutil.copytree(
-                    self.source_dir / first_dir,
-                    self.npm_package_dir,
-                    dirs_exist_ok=True,
-                )
-
-                break
+        with tarfile.open(fileobj=self._source) as tar:
+            tar.extractall(self.npm_package_dir, members=strip_tar_root(tar))
 
     def _write_lines(self, path: Path, lines: Sequence[str]):
         """
         Convenience tool to build files
         """
 
-        with path.open("w") as f:
-            f.write("".join(f"{line}\n" for line in lines))
+        path.write_text("\n".join(lines) + "\n")
 
     def _write_dist_info_wheel(self):
         """
@@ -314,7 +406,7 @@ class PackageTranslator:
         we got. If we can't find a package well too bad.
         """
 
-        if self.version.distribution.original is None:
+        if self.version.distribution.original_id is None:
             if self.version.dependencies is False:
                 resolver = Resolver(self.version)
                 resolver.resolve()
@@ -417,27 +509,6 @@ class PackageTranslator:
 
         self._write_lines(self.dist_info_dir / "METADATA", lines)
 
-    def _write_dist_info_records(self):
-        """
-        Basically we compute the hash of every single file in the archive and
-        write it down this RECORDS file.
-        """
-
-        lines = []
-
-        for path in self.wheel_dir.glob("**/*"):
-            if path.is_file():
-                rel_path = path.relative_to(self.wheel_dir)
-                with path.open("rb") as f:
-                    h = f"sha256={urlsafe_b64encode_nopad(file_digest(f, 'sha256').digest()).decode('ascii')}"
-                s = path.stat().st_size
-
-                lines.append(f"{rel_path},{h},{s}")
-
-        lines.append(f"{self.dist_info_dir.relative_to(self.wheel_dir)}/RECORD,,")
-
-        self._write_lines(self.dist_info_dir / "RECORD", lines)
-
     def _guess_entry_points(
         self,
     ) -> Tuple[Mapping[str, DedupMapEntry], Mapping[str, str]]:
@@ -539,7 +610,7 @@ class PackageTranslator:
         Umbrella call for all which pertains to bin and entrypoints
         """
 
-        if self.distribution.original is not None:
+        if self.distribution.original_id is not None:
             return
 
         self.py_module_dir.mkdir(parents=True, exist_ok=True)
@@ -558,7 +629,6 @@ class PackageTranslator:
         self._write_dist_info_wheel()
         self._write_dist_info_license()
         self._write_dist_info_metadata()
-        self._write_dist_info_records()
         self._write_bin()
 
     def _zip_wheel(self):
@@ -566,6 +636,11 @@ class PackageTranslator:
         All the content of the wheel has been laid out in the working folder,
         now we generate a full zip file containing all this.
 
+        While we're at it, we compute the hash of every single file in order
+        to write the RECORD file, which comes last in the archive. This way
+        each file only gets read once, by chunks since some packages ship
+        files of hundreds of MB.
+
         Notes
         -----
         We're setting strict_timestamps=False because the range of allowed
@@ -575,17 +650,40 @@ class PackageTranslator:
         able to put correct timestamps and not just DOS crap.
         """
 
+        record = []
+
         with self.wheel_path.open("wb") as f:
             with zipfile.ZipFile(
                 file=f,
                 mode="w",
-                compresslevel=9,
+                compresslevel=WHEEL_COMPRESS_LEVEL,
                 compression=zipfile.ZIP_DEFLATED,
                 strict_timestamps=False,
             ) as z:
                 for path in self.wheel_dir.glob("**/*"):
-                    if path.is_file():
-                        z.write(path, path.relative_to(self.wheel_dir))
+                    if path.is_file() and not path.is_symlink():
+                        rel_path = path.relative_to(self.wheel_dir)
+                        info = zipfile.ZipInfo.from_file(
+                            path, rel_path, strict_timestamps=False
+                        )
+
+                        if path.suffix.lower() in STORED_SUFFIXES:
+                            info.compress_type = zipfile.ZIP_STORED
+                        else:
+                            info.compress_type = z.compression
+
+                        # Entries opened from a ZipInfo don't get the archive's
+                        # level, that's what writestr() does as well
+                        info._compresslevel = z.compresslevel
+
+                        with path.open("rb") as src, z.open(info, "w") as dst:
+                            digest, size = copy_and_hash(src, dst)
+
+                        record.append(f"{rel_path},{digest},{size}")
+
+                record_path = self.dist_info_dir.relative_to(self.wheel_dir) / "RECORD"
+                record.append(f"{record_path},,")
+                z.writestr(str(record_path), "\n".join(record) + "\n")
 
     def _translate(self):
         """
@@ -595,7 +693,6 @@ class PackageTranslator:
         self._download_source()
         self._check_source_integrity()
         self._extract_source()
-        self._copy_source()
         self._write_dist_info()
         self._zip_wheel()
 
@@ -617,4 +714,7 @@ class PackageTranslator:
         Everything must go away now.
         """
 
+        if self._source is not None:
+            self._source.close()
+
         self._work_dir.cleanup()
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
-from typing import Literal, Optional, Sequence, Union
+from functools import cached_property, lru_cache
+from typing import List, Literal, Optional, Sequence, Tuple, Union
 
 import lark
 from packaging.version import Version as PyVersion
@@ -41,6 +42,10 @@ MIN_VER = Sentinel(False)
 
 VersionPart = Union[int, Literal["x"]]
 
+# PartialVersion is frozen (thus hashable) and the ranges it produces are
+# immutable, so the same partial always gives back the same Range objects
+PARTIAL_RANGE_CACHE_SIZE = 1024
+
 
 @dataclass(frozen=True)
 class PartialVersion:
@@ -69,7 +74,7 @@ class PartialVersion:
         """
 
         if self.major == "x":
-            return Range(Bound(MIN_VER), Bound(MAX_VER))
+            return Range(BOUND_MIN, BOUND_MAX)
 
         if self.minor is None or self.minor == "x":
             if self.major == 0:
@@ -93,6 +98,7 @@ class PartialVersion:
                 ),
             )
 
+    @lru_cache(PARTIAL_RANGE_CACHE_SIZE)
     def as_range(self) -> "Range":
         """
         The range form is the range you'll get without a modifier.
@@ -114,6 +120,7 @@ class PartialVersion:
             ),
         )
 
+    @lru_cache(PARTIAL_RANGE_CACHE_SIZE)
     def primitive(self, comparator: str) -> "Range":
         """
         Depending on the operator that was found, we'll call a different way of
@@ -138,18 +145,18 @@ class PartialVersion:
         """
 
         if self.major == "x":
-            return Range(Bound(MIN_VER), Bound(MAX_VER))
+            return Range(BOUND_MIN, BOUND_MAX)
 
         if self.minor is None or self.minor == "x":
             return Range(
                 Bound(SemVersion(self.major, 0, 0)),
-                Bound(MAX_VER),
+                BOUND_MAX,
             )
 
         if self.patch is None or self.patch == "x":
             return Range(
                 Bound(SemVersion(self.major, self.minor, 0)),
-                Bound(MAX_VER),
+                BOUND_MAX,
             )
 
         return Range(
@@ -158,7 +165,7 @@ class PartialVersion:
                     self.major, self.minor, self.patch, prerelease=self.prerelease
                 )
             ),
-            Bound(MAX_VER),
+            BOUND_MAX,
         )
 
     def _primitive_gt(self) -> "Range":
@@ -167,18 +174,18 @@ class PartialVersion:
         """
 
         if self.major == "x":
-            return Range(Bound(MAX_VER), Bound(MAX_VER))
+            return Range(BOUND_MAX, BOUND_MAX)
 
         if self.minor is None or self.minor == "x":
             return Range(
                 Bound(SemVersion(self.major + 1, 0, 0)),
-                Bound(MAX_VER),
+                BOUND_MAX,
             )
 
         if self.patch is None or self.patch == "x":
             return Range(
                 Bound(SemVersion(self.major, self.minor + 1, 0)),
-                Bound(MAX_VER),
+                BOUND_MAX,
             )
 
         return Range(
@@ -188,7 +195,7 @@ class PartialVersion:
                 ),
                 inclusive=False,
             ),
-            Bound(MAX_VER),
+            BOUND_MAX,
         )
 
     def _primitive_le(self) -> "Range":
@@ -197,11 +204,11 @@ class PartialVersion:
         """
 
         if self.major == "x":
-            return Range(Bound(MIN_VER), Bound(MAX_VER))
+            return Range(BOUND_MIN, BOUND_MAX)
 
         if self.minor is None or self.minor == "x":
             return Range(
-                Bound(MIN_VER),
+                BOUND_MIN,
                 Bound(
                     SemVersion(self.major + 1, 0, 0, prerelease="0"), inclusive=False
                 ),
@@ -209,7 +216,7 @@ class PartialVersion:
 
         if self.patch is None or self.patch == "x":
             return Range(
-                Bound(MIN_VER),
+                BOUND_MIN,
                 Bound(
                     SemVersion(self.major, self.minor + 1, 0, prerelease="0"),
                     inclusive=False,
@@ -217,7 +224,7 @@ class PartialVersion:
             )
 
         return Range(
-            Bound(MIN_VER),
+            BOUND_MIN,
             Bound(
                 SemVersion(
                     self.major, self.minor, self.patch, prerelease=self.prerelease
@@ -232,17 +239,17 @@ class PartialVersion:
         """
 
         if self.major == "x":
-            return Range(Bound(MIN_VER), Bound(MIN_VER))
+            return Range(BOUND_MIN, BOUND_MIN)
 
         if self.minor is None or self.minor == "x":
             return Range(
-                Bound(MIN_VER),
+                BOUND_MIN,
                 Bound(SemVersion(self.major, 0, 0, prerelease="0"), inclusive=False),
             )
 
         if self.patch is None or self.patch == "x":
             return Range(
-                Bound(MIN_VER),
+                BOUND_MIN,
                 Bound(
                     SemVersion(self.major, self.minor, 0, prerelease="0"),
                     inclusive=False,
@@ -250,7 +257,7 @@ class PartialVersion:
             )
 
         return Range(
-            Bound(MIN_VER),
+            BOUND_MIN,
             Bound(
                 SemVersion(
                     self.major, self.minor, self.patch, prerelease=self.prerelease
@@ -266,6 +273,7 @@ class PartialVersion:
 
         return self.as_range()
 
+    @lru_cache(PARTIAL_RANGE_CACHE_SIZE)
     def tilde(self):
         """
         Apply the tilde logic
@@ -286,13 +294,14 @@ class PartialVersion:
             ),
         )
 
+    @lru_cache(PARTIAL_RANGE_CACHE_SIZE)
     def caret(self):
         """
         Apply the caret logic
         """
 
         if self.major == "x":
-            return Range(Bound(MIN_VER), Bound(MAX_VER))
+            return Range(BOUND_MIN, BOUND_MAX)
 
         if self.major == 0:
             return self.tilde()
@@ -325,6 +334,27 @@ class PartialVersion:
 Ver = Union[Sentinel, SemVersion]
 
 
+def _sem_key(v: SemVersion) -> Tuple:
+    """
+    Sort key following the same precedence as SemVersion's own comparison:
+    releases come after their pre-releases, and pre-release identifiers are
+    compared one by one with numbers before (and compared as) integers and
+    strings after. Build metadata doesn't count.
+    """
+
+    if not v.prerelease:
+        return (v.major, v.minor, v.patch), 1, ()
+
+    return (
+        (v.major, v.minor, v.patch),
+        0,
+        tuple(
+            (0, int(p), "") if p.isdigit() and p.isascii() else (1, 0, p)
+            for p in v.prerelease.split(".")
+        ),
+    )
+
+
 @dataclass(frozen=True)
 class Bound:
     """
@@ -337,29 +367,102 @@ class Bound:
     version: Ver
     inclusive: bool = True
 
-    def _lt_bound(self, other: "Bound") -> bool:
-        if (
-            self.version.__class__ is other.version.__class__
-            and self.version == other.version
-        ):
-            return self.inclusive and not other.inclusive
+    @cached_property
+    def _release(self) -> Optional[Tuple[Tuple[int, int, int], bool, bool]]:
+        """
+        Comparing SemVer objects is quite slow, however most of the time we
+        compare plain releases (no pre-release) against the bounds, which
+        boils down to comparing (major, minor, patch) tuples.
 
-        if isinstance(self.version, Sentinel):
-            return self.version.__lt__(other.version)
-        elif isinstance(other.version, Sentinel):
-            return other.version.__gt__(self.version)
+        A plain release "v" is never equal to a pre-release bound "b" and
+        falls on the same side of "b" as it does of b's (major, minor, patch)
+        itself, so those can use the tuple as well.
+
+        Returns None for sentinels, otherwise the (major, minor, patch) tuple
+        and whether a tuple equality satisfies respectively "bound < v" and
+        "bound > v".
+        """
+
+        v = self.version
+
+        if isinstance(v, SemVersion):
+            plain = not v.prerelease
+            return (
+                (v.major, v.minor, v.patch),
+                self.inclusive or not plain,
+                self.inclusive and plain,
+            )
+
+    @cached_property
+    def _key(self) -> Tuple:
+        """
+        Sort key of the bound, so that comparing two bounds is a single tuple
+        comparison instead of going through SemVer's compare() and the
+        sentinels special cases.
+
+        MIN_VER sorts before all versions and MAX_VER after, then at equal
+        versions an inclusive bound comes before an exclusive one.
+        """
+
+        v = self.version
+
+        if isinstance(v, Sentinel):
+            return 2 if v.always_bigger else 0, (), not self.inclusive
+
+        return 1, _sem_key(v), not self.inclusive
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        elif isinstance(other, Bound):
+            return self._key == other._key
         else:
-            return self.version < other.version
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(self._key)
 
     def _lt_version(self, other: SemVersion) -> bool:
+        if (r := self._release) is not None and not other.prerelease:
+            triple, eq_ok, _ = r
+            o = (other.major, other.minor, other.patch)
+            return triple <= o if eq_ok else triple < o
+
+        rank, key, _ = self._key
+
+        if rank != 1:
+            return rank == 0
+
+        if key[0] != (o := (other.major, other.minor, other.patch)):
+            return key[0] < o
+
         if self.inclusive:
-            return self.version <= other
+            return key <= _sem_key(other)
         else:
-            return self.version < other
+            return key < _sem_key(other)
+
+    def _gt_version(self, other: SemVersion) -> bool:
+        if (r := self._release) is not None and not other.prerelease:
+            triple, _, eq_ok = r
+            o = (other.major, other.minor, other.patch)
+            return triple >= o if eq_ok else triple > o
+
+        rank, key, _ = self._key
+
+        if rank != 1:
+            return rank == 2
+
+        if key[0] != (o := (other.major, other.minor, other.patch)):
+            return key[0] > o
+
+        if self.inclusive:
+            return key >= _sem_key(other)
+        else:
+            return key > _sem_key(other)
 
     def __lt__(self, other):
         if isinstance(other, Bound):
-            return self._lt_bound(other)
+            return self._key < other._key
         elif isinstance(other, SemVersion):
             return self._lt_version(other)
         else:
@@ -369,22 +472,19 @@ class Bound:
         if isinstance(other, SemVersion):
             return self._lt_version(other)
         else:
-            return self < other or self == other
+            return self._key <= other._key
 
     def __gt__(self, other):
         if isinstance(other, SemVersion):
-            if self.inclusive:
-                return self.version >= other
-            else:
-                return self.version > other
+            return self._gt_version(other)
         else:
-            return not self <= other
+            return self._key > other._key
 
     def __ge__(self, other):
         if isinstance(other, SemVersion):
             return self > other
         else:
-            return self > other or self == other
+            return self._key >= other._key
 
     def as_py_bound(self):
         """
@@ -400,6 +500,12 @@ class Bound:
             return PyBound(py, self.inclusive)
 
 
+# Open-ended bounds are everywhere, since they are immutable there is no need
+# to create new ones every single time
+BOUND_MIN = Bound(MIN_VER)
+BOUND_MAX = Bound(MAX_VER)
+
+
 # noinspection PyUnresolvedReferences
 class RangeStrMixin:
     def __str__(self):
@@ -459,18 +565,56 @@ class Range(RangeStrMixin):
     they intersect, apply different kind of conditions, etc).
     """
 
-    min: Bound = Bound(MIN_VER)
-    max: Bound = Bound(MAX_VER)
+    min: Bound = BOUND_MIN
+    max: Bound = BOUND_MAX
 
     def as_py_range(self):
         return PyRange(self.min.as_py_bound(), self.max.as_py_bound())
 
+    @cached_property
+    def _release(self) -> Optional[tuple]:
+        """
+        Both bounds pre-digested for contains() to check plain releases with
+        nothing more than tuple comparisons. Each bound is either None (an
+        open end, which accepts everything) or the (major, minor, patch)
+        tuple and whether equality is accepted. If one end can never be
+        satisfied (a MAX_VER lower bound by example) then we just return
+        None and let the regular path deal with it.
+        """
+
+        out = []
+
+        # The last item tells which flag of Bound._release applies to that end
+        for bound, open_end, side in ((self.min, MIN_VER, 1), (self.max, MAX_VER, 2)):
+            if isinstance(bound.version, Sentinel):
+                if bound.version.always_bigger != open_end.always_bigger:
+                    return None
+
+                out.append(None)
+            else:
+                release = bound._release
+                out.append((release[0], release[side]))
+
+        return tuple(out)
+
     def contains(self, version: SemVersion) -> bool:
         """
         Check if a version is contained in this range
         """
 
-        return self.min.__lt__(version) and self.max.__gt__(version)
+        if not version.prerelease and (r := self._release) is not None:
+            v = (version.major, version.minor, version.patch)
+            lo, hi = r
+
+            if lo is not None and not (lo[0] <= v if lo[1] else lo[0] < v):
+                return False
+
+            if hi is not None and not (hi[0] >= v if hi[1] else hi[0] > v):
+                return False
+
+            return True
+
+        return self.min._lt_version(version) and self.max._gt_version(version)
 
 
 PyVer = Union[Sentinel, PyVersion]
@@ -559,15 +703,15 @@ wildcard: "x" | "X" | "*"
 nr: /(0|[1-9][0-9]*)/
 tilde: "~" partial
 caret: "^" partial
-qualifier: ("-" pre)? ("+" build)?
+qualifier: "-" pre
+         | "+" build
+         | "-" pre "+" build
 pre: parts
 build: parts
 parts: part ("." part)*
-part: nr | /[-0-9A-Za-z]+/
+part: /[-0-9A-Za-z]+/
 """
 
-LARK_GRAMMAR = lark.Lark(GRAMMAR, start="range_set")
-
 
 def _is_overlapping(a: Range, b: Range) -> bool:
     """
@@ -593,25 +737,37 @@ def _intersect_ranges(a: Range, b: Range) -> Sequence[Range]:
     ]
 
 
-def intersect_ranges(ranges: Sequence[Range]) -> Sequence[Range]:
+def intersect_ranges(ranges: Sequence[Range]) -> Tuple[Range, ...]:
     """
     Computes the intersection between all the provided ranges at once.
+
+    The intersection of ranges is at most one range, so we only need to keep
+    track of the highest lower bound and of the lowest upper bound as we go
+    instead of building an intermediate Range at each step.
     """
 
     if not ranges:
-        return []
+        return ()
 
-    out = [ranges[0]]
+    first = ranges[0]
+    lo, hi = first.min, first.max
 
-    for r in ranges:
-        new_out = []
+    if not lo <= hi:
+        return ()
 
-        for o in out:
-            new_out.extend(_intersect_ranges(o, r))
+    for r in ranges[1:]:
+        if not (lo <= r.max and r.min <= hi):
+            return ()
 
-        out = new_out
+        lo = max(lo, r.min)
+        hi = min(hi, r.max)
 
-    return out
+    # Most of the time there is a single range (or the first one is already
+    # the narrowest) so there is no need to create a new one
+    if lo is first.min and hi is first.max:
+        return (first,)
+
+    return (Range(min=lo, max=hi),)
 
 
 def _union_ranges(a: Range, b: Range) -> Sequence[Range]:
@@ -653,6 +809,46 @@ def union_ranges(ranges: Sequence[Range]) -> Sequence[Range]:
     return out
 
 
+def _merge_ranges(ranges: Sequence[Range]) -> List[Range]:
+    """
+    Sorts ranges by their lower bound and merges the overlapping ones, so
+    that we end up with a list of disjoint ranges in order.
+    """
+
+    out = []
+
+    for r in sorted(ranges, key=lambda x: x.min):
+        if out and _is_overlapping(out[-1], r):
+            out[-1] = Range(min=out[-1].min, max=max(out[-1].max, r.max))
+        else:
+            out.append(r)
+
+    return out
+
+
+def intersect_range_sets(a: Sequence[Range], b: Sequence[Range]) -> Sequence[Range]:
+    """
+    Intersects two sets of ranges (each being the union of its ranges). Both
+    sets are sorted and merged first, then we walk them side by side and only
+    intersect ranges that can overlap instead of trying all the pairs.
+    """
+
+    a = _merge_ranges(a)
+    b = _merge_ranges(b)
+    out = []
+    i = j = 0
+
+    while i < len(a) and j < len(b):
+        out.extend(_intersect_ranges(a[i], b[j]))
+
+        if a[i].max < b[j].max:
+            i += 1
+        else:
+            j += 1
+
+    return out
+
+
 class VersionSpecTransformer(lark.Transformer):
     """
     Transformer to decode the AST from Lark which parsed the version spec
@@ -747,20 +943,29 @@ class VersionSpecTransformer(lark.Transformer):
             if i:
                 out.extend(i)
 
-        return out
+        return tuple(out)
+
 
+# The transformer is applied while parsing (which LALR allows) so that we
+# don't have to build the whole tree first only to walk it right after
+LARK_GRAMMAR = lark.Lark(
+    GRAMMAR,
+    start="range_set",
+    parser="lalr",
+    transformer=VersionSpecTransformer(),
+)
 
-def parse_spec(spec: str) -> Sequence[Range]:
+
+def parse_spec(spec: str) -> Tuple[Range, ...]:
     """
-    Transforms a version spec into a list of ranges
+    Transforms a version spec into a tuple of ranges (immutable, so that
+    results can safely be cached and shared)
     """
 
     try:
-        tree = LARK_GRAMMAR.parse(spec)
-    except lark.exceptions.UnexpectedCharacters:
+        return LARK_GRAMMAR.parse(spec)
+    except lark.exceptions.UnexpectedInput:
         raise ValueError(f"Invalid version spec: {spec}")
-    else:
-        return VersionSpecTransformer().transform(tree)
 
 
 def flatten_py_range(spec: str, ranges: Sequence[PyRange]) -> str:
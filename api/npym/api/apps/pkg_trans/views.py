@@ -107,7 +107,7 @@ def make_archive(package_name: str, python_version: str) -> Archive:
         python_name_searchable=package_name,
     )
     version = get_object_or_404(
-        Version,
+        Version.objects.select_related("distribution"),
         distribution=distribution,
         python_version=python_version,
     )
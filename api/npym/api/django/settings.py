@@ -77,3 +77,31 @@ with EnvManager(ModelWDjango(enable_storages=True)) as env:
     # ---
 
     NPYM_PREFIX = "npym"
+
+
+# ---
+# Database
+# ---
+
+# Management commands (and the resolver) fire a lot of queries in a row, so
+# keep connections open instead of paying the handshake every time.
+DATABASES["default"]["CONN_MAX_AGE"] = 600
+
+# ---
+# Cache
+# ---
+
+# Django's own default if the preset didn't configure anything
+CACHES = globals().get(
+    "CACHES",
+    {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+
+# Package infos from NPM are kept in the DB so that they survive restarts and
+# are shared by all the workers (see migration 0006 for the table). They are
+# revalidated against NPM at each use so the entries can stay around.
+CACHES["npm"] = {
+    "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+    "LOCATION": "pkg_trans_npm_cache",
+    "OPTIONS": {"MAX_ENTRIES": 50_000},
+}